@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+"""Time startup of short ``latexpages`` invocations and pdfinfo/pdftk discovery."""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPEAT = 20
+
+COMMANDS = {'latexpages --version': ['-m', 'latexpages', '--version'],
+            'latexpages-clean --help': ['-c', 'from latexpages.__main__ import main_clean;'
+                                              ' main_clean()', '--help'],
+            'import latexpages': ['-c', 'import latexpages'],
+            'import latexpages.building': ['-c', 'import latexpages.building'],
+            'Npages.get_func()': ['-c', 'from latexpages import backend;'
+                                        ' backend.Npages.get_func()']}
+
+
+def timeit(args, *, repeat: int = REPEAT) -> list[float]:
+    cmd = [sys.executable, *args]
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(cmd, env=env, check=False,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+if __name__ == '__main__':
+    baseline = min(timeit(['-c', 'pass']))
+    print(f'{"python -c pass":<30} {baseline * 1000:7.1f} ms (min)')
+    for name, args in COMMANDS.items():
+        times = timeit(args)
+        print(f'{name:<30} {min(times) * 1000:7.1f} ms (min)'
+              f' {statistics.median(times) * 1000:7.1f} ms (median)'
+              f' {(min(times) - baseline) * 1000:+7.1f} ms (over baseline)')
@@ -1,8 +1,6 @@
 """Combine a collection of LaTeX documents into a single PDF file."""
 
-from .cleaning import clean
-from .building import make
-from .numbering import paginate
+import importlib
 
 __all__ = ['make', 'paginate', 'clean']
 
@@ -11,3 +9,21 @@ __version__ = '0.8.1.dev0'
 __author__ = 'Sebastian Bank <sebastian.bank@uni-leipzig.de>'
 __license__ = 'MIT, see LICENSE.txt'
 __copyright__ = 'Copyright (c) 2014-2025 Sebastian Bank'
+
+_SUBMODULES = {'make': 'building',
+               'paginate': 'numbering',
+               'clean': 'cleaning'}
+
+
+def __getattr__(name: str):
+    """Import the submodule providing name on first access (fast startup)."""
+    try:
+        submodule = _SUBMODULES[name]
+    except KeyError:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}') from None
+    value = globals()[name] = getattr(importlib.import_module(f'.{submodule}', __name__), name)
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(__all__))
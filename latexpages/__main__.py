@@ -4,9 +4,9 @@ import argparse
 import os
 import sys
 
-from . import __version__, make, paginate, clean
+from . import __version__
 
-__all__ = ['main', 'main_paginate', 'main_clean']
+__all__ = ['main', 'main_paginate', 'main_clean', 'main_serve']
 
 INIFILE = 'latexpages.ini'
 
@@ -25,23 +25,54 @@ def main() -> None:
     parser.add_argument('--keep', dest='cleanup', action='store_false',
         help='keep combination document(s) and their auxiliary files')
 
-    parser.add_argument('--only', dest='only', metavar='<part>', default=None,
-        help='compile the given part without combining')
+    parser.add_argument('--only', dest='only', metavar='<part>', action='append', default=None,
+        help='compile only the given part(s) without combining '
+             '(comma-separated, glob patterns, can be repeated)')
+
+    parser.add_argument('--combine', dest='combine', action='store_true',
+        help='with --only: copy the compiled parts and recombine '
+             'reusing the PDFs of all other parts')
+
+    parser.add_argument('--draft', dest='draft', action='store_true',
+        help='fast proof build with the draft options into the draft directory')
 
     parser.add_argument('--processes', dest='processes', metavar='<n>', type=int, default=None,
         help='number of parallel processes (default: one per core)')
 
+    parser.add_argument('--threads', dest='threads', action='store_const', const=True, default=None,
+        help='compile in parallel threads instead of processes')
+
+    parser.add_argument('--timeout', dest='timeout', metavar='<s>', type=int, default=None,
+        help='kill a part compilation after this many seconds (default: no limit)')
+
+    parser.add_argument('--retries', dest='retries', metavar='<n>', type=int, default=None,
+        help='recompile failed or timed out parts up to n times (default: 0)')
+
     parser.add_argument('filename', nargs='?', default=None,
         help='INI file configuring the parts and output options '
              f'(default: {INIFILE} in the current directory)')
 
     args = parser.parse_args_default_filename()
 
-    make(args.filename,
-         processes=args.processes,
-         engine=args.engine,
-         cleanup=args.cleanup,
-         only=args.only)
+    from . import make
+
+    if args.only is not None:
+        args.only = [p for only in args.only for p in only.split(',') if p]
+    elif args.combine:
+        parser.error('--combine requires --only')
+
+    ok = make(args.filename,
+              processes=args.processes,
+              engine=args.engine,
+              cleanup=args.cleanup,
+              only=args.only,
+              combine=args.combine,
+              timeout=args.timeout,
+              retries=args.retries,
+              draft=args.draft,
+              threads=args.threads)
+    if not ok:
+        sys.exit(1)
 
 
 def main_paginate() -> None:
@@ -57,6 +88,9 @@ def main_paginate() -> None:
              f'(default: {INIFILE} in the current directory)')
 
     args = parser.parse_args_default_filename()
+
+    from . import paginate
+
     paginate(args.filename)
 
 
@@ -76,9 +110,39 @@ def main_clean() -> None:
              f'(default: {INIFILE} in the current directory)')
 
     args = parser.parse_args_default_filename()
+
+    from . import clean
+
     clean(args.filename, clean_output=args.clean_output)
 
 
+def main_serve() -> None:
+    """Run the command-line interface for the build service."""
+    parser = argparse.ArgumentParser(prog='latexpages-serve',
+        description='Serves make, paginate, and clean over a local HTTP API.')
+
+    parser.add_argument('--version', action='version',
+                        version=f'%(prog)s {_version()}')
+
+    parser.add_argument('--host', dest='host', metavar='<host>', default='127.0.0.1',
+        help='interface to listen on (default: 127.0.0.1)')
+
+    parser.add_argument('--port', dest='port', metavar='<port>', type=int, default=8000,
+        help='port to listen on (default: 8000)')
+
+    parser.add_argument('--processes', dest='processes', metavar='<n>', type=int, default=None,
+        help='number of parallel processes shared by all builds (default: one per core)')
+
+    parser.add_argument('--threads', dest='threads', action='store_true',
+        help='run the builds in parallel threads instead of processes')
+
+    args = parser.parse_args()
+
+    from .serving import serve
+
+    serve(host=args.host, port=args.port, processes=args.processes, threads=args.threads)
+
+
 def _version() -> str:
     pkg_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     (python_version, *_) = sys.version.partition(' ')
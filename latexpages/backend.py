@@ -2,17 +2,24 @@
 
 from collections.abc import Callable, Sequence
 import errno
+import json
 import os
-import platform
 import re
+import shutil
+import signal
 import subprocess
 import sys
+import threading
+import time
+import typing
 
 from . import tools
 
-__all__ = ['compile', 'Npages']
+__all__ = ['compile', 'run', 'which', 'linearize', 'splice', 'optimize', 'Npages']
 
-PLATFORM = platform.system().lower()
+WHICH_CACHE = 'which.json'
+
+WHICH_CACHE_SIZE = 8
 
 OPTS = {'latexmk': ['-silent'],
         'texify': ['--batch', '--verbose', '--quiet'],
@@ -34,30 +41,189 @@ else:
         return None
 
 
-def apply(object, args=(), kwargs=None):
-    if kwargs is None:
-        kwargs = {}
-    return object(*args, **kwargs)
+if sys.platform == 'win32':  # pragma: no cover
+    NEW_GROUP: dict[str, typing.Any] = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+
+    def kill_group(proc) -> None:
+        """Kill the process and all of its children."""
+        subprocess.call(['taskkill', '/F', '/T', '/PID', str(proc.pid)],
+                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                        startupinfo=get_startupinfo())
+        proc.kill()
+else:
+    NEW_GROUP: dict[str, typing.Any] = {'start_new_session': True}
+
+    def kill_group(proc) -> None:
+        """Kill the process group started by the process."""
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+def which(name: str) -> str | None:
+    """Return the path of the executable name on PATH or None (cached on disk).
+
+    Cache entries are keyed on PATH and dropped when the modification time
+    of a PATH directory or of the found executable changes.
+    """
+    with _which_lock:  # shared by the threads of a ThreadPool
+        return _which(name)
+
+
+def _which(name: str) -> str | None:
+    path = os.environ.get('PATH', os.defpath)
+    cache = _load_which_cache()
+    dirs = [d for d in path.split(os.pathsep) if d]
+    mtimes = {d: _mtime(d) for d in dirs}
+
+    entry = cache.pop(path, None)
+    if entry is None or entry['dirs'] != mtimes:
+        entry = {'dirs': mtimes, 'found': {}}
+    cache[path] = entry
+    for stale in list(cache)[:-WHICH_CACHE_SIZE]:
+        del cache[stale]
+
+    found = entry['found']
+    if name in found:
+        result, mtime = found[name]
+        if result is None or _mtime(result) == mtime:
+            return result
+
+    result = shutil.which(name, path=path)
+    found[name] = (result, _mtime(result) if result is not None else None)
+    _save_which_cache(cache)
+    return result
+
+
+def _mtime(path) -> int | None:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+_which_cache: dict | None = None
+
+_which_lock = threading.Lock()
+
+
+def _load_which_cache() -> dict:
+    global _which_cache
+    if _which_cache is None:
+        try:
+            with open(tools.cache_dir(WHICH_CACHE), encoding='utf-8') as fd:
+                _which_cache = json.load(fd)
+        except (OSError, ValueError):
+            _which_cache = {}
+    return _which_cache
+
+
+def _save_which_cache(cache) -> None:
+    filename = tools.cache_dir(WHICH_CACHE)
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(f'{filename}.{os.getpid()}', 'w', encoding='utf-8') as fd:
+            json.dump(cache, fd)
+        os.replace(f'{filename}.{os.getpid()}', filename)
+    except OSError:
+        pass
+
+
+def run(cmd, *, cwd=None, timeout=None, output=None, env=None) -> int:
+    """Run cmd with closed stdin in a new process group, return its exit status.
+
+    Kills the whole process group and raises ``subprocess.TimeoutExpired``
+    if cmd does not finish within timeout seconds (``tools.StoppedError`` if the
+    ``tools.ThreadPool`` running the current thread is terminated).
+
+    If output is a list, stdout and stderr are captured into it as
+    ``(time.monotonic(), line)`` pairs instead of going to the console.
+    """
+    capture: dict[str, typing.Any]
+    if output is None:
+        capture = {}
+    else:
+        capture = {'stdout': subprocess.PIPE, 'stderr': subprocess.STDOUT,
+                   'encoding': 'utf-8', 'errors': 'replace'}
+
+    stop = tools.stop_event()
+    if stop is not None and stop.is_set():
+        raise tools.StoppedError
+
+    proc = subprocess.Popen(cmd, cwd=cwd or None, stdin=subprocess.DEVNULL, env=env,
+                            startupinfo=get_startupinfo(),
+                            **capture, **NEW_GROUP)
+
+    if output is not None:
+        reader = threading.Thread(target=read_lines, args=(proc.stdout, output),
+                                  daemon=True)
+        reader.start()
+
+    try:
+        if stop is None:
+            return proc.wait(timeout=timeout)
+        return wait(proc, timeout=timeout, stop=stop)
+    except BaseException:
+        kill_group(proc)
+        proc.wait()
+        raise
+    finally:
+        if proc.stdout is not None:
+            reader.join()
+            proc.stdout.close()
+
+
+def wait(proc, *, timeout=None, stop, interval: float = 0.1) -> int:
+    """Wait for proc like ``proc.wait()``, raise ``tools.StoppedError`` when stop is set."""
+    start = time.monotonic()
+    while True:
+        left = remaining(timeout, start)
+        try:
+            return proc.wait(timeout=interval if left is None else min(interval, left))
+        except subprocess.TimeoutExpired:
+            if stop.is_set():
+                raise tools.StoppedError
+            if left is not None and left <= interval:
+                raise subprocess.TimeoutExpired(proc.args, timeout)
+
+
+def read_lines(fd, output) -> None:
+    """Append timestamped lines from fd to output until end of file."""
+    for line in fd:
+        output.append((time.monotonic(), line.rstrip('\n')))
+
+
+def remaining(timeout, start) -> float | None:
+    """Return the seconds left from timeout since the monotonic start time."""
+    if timeout is None:
+        return None
+    return max(0, timeout - (time.monotonic() - start))
 
 
 def compile(filename, *,
-            dvips=False, view=False, engine=None, options=None) -> None:
+            dvips=False, view=False, engine=None, options=None,
+            timeout=None, output=None, env=None) -> int:
     """Compile LaTeX file to PDF using either latexmk.pl or texify.exe."""
     compile_funcs = {'latexmk': latexmk_compile,
                      'texify': texify_compile,
                      None: default_compile}
     if engine not in compile_funcs:
         raise ValueError(f'unknown engine: {engine!r}')
-    compile_funcs[engine](filename, dvips=dvips, view=view, options=options)
+    return compile_funcs[engine](filename, dvips=dvips, view=view,
+                                 options=options, timeout=timeout,
+                                 output=output, env=env)
 
 
 def no_compile(filename, *,
-               dvips=False, view=False, options=None) -> None:
+               dvips=False, view=False, options=None, timeout=None,
+               output=None, env=None) -> int:
     raise NotImplementedError('platform not supported')
 
 
 def latexmk_compile(filename, *,
-                    dvips=False, view=False, options=None) -> None:
+                    dvips=False, view=False, options=None, timeout=None,
+                    output=None, env=None) -> int:
     """Compile LaTeX file with the latexmk perl script."""
     (compile_dir, filename) = os.path.split(filename)
 
@@ -73,21 +239,22 @@ def latexmk_compile(filename, *,
         latexmk.append('-pv')
     latexmk.append(filename)
 
-    with tools.chdir(compile_dir):
-        try:
-            subprocess.call(latexmk, startupinfo=get_startupinfo())
-        except OSError as e:
-            if e.errno == errno.ENOENT:
-                raise RuntimeError(f'failed to execute {latexmk!r}, '
-                                   'make sure the latexmk executable '
-                                   'is on your systems\' path')
-            else:
-                raise
+    try:
+        return run(latexmk, cwd=compile_dir, timeout=timeout, output=output, env=env)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            raise RuntimeError(f'failed to execute {latexmk!r}, '
+                               'make sure the latexmk executable '
+                               'is on your systems\' path')
+        else:
+            raise
 
 
 def texify_compile(filename, *,
-                   dvips=False, view=False, options=None) -> None:
+                   dvips=False, view=False, options=None, timeout=None,
+                   output=None, env=None) -> int:
     """Compile LaTeX file using MikTeX's texify utility."""
+    start = time.monotonic()
     (compile_dir, filename) = os.path.split(filename)
 
     if options is None:
@@ -100,39 +267,130 @@ def texify_compile(filename, *,
         texify.append('--run-viewer')
     texify.append(filename)
 
-    with tools.chdir(compile_dir):
-        try:
-            subprocess.call(texify, startupinfo=get_startupinfo())
-        except OSError as e:
-            if e.errno == errno.ENOENT:
-                raise RuntimeError(f'failed to execute {texify!r}, '
-                                   'make sure the MikTeX executables '
-                                   'are on your systems\' path')
-            else:
-                raise
+    try:
+        returncode = run(texify, cwd=compile_dir, timeout=timeout, output=output, env=env)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            raise RuntimeError(f'failed to execute {texify!r}, '
+                               'make sure the MikTeX executables '
+                               'are on your systems\' path')
+        else:
+            raise
 
-        if dvips:
-            dvips = ['dvips', '-P', 'pdf'] + options['dvips']
-            dvips.append(tools.swapext(filename, 'dvi'))
-            subprocess.call(dvips, startupinfo=get_startupinfo())
+    if dvips:
+        dvips = ['dvips', '-P', 'pdf'] + options['dvips']
+        dvips.append(tools.swapext(filename, 'dvi'))
+        dvips_returncode = run(dvips, cwd=compile_dir, timeout=remaining(timeout, start),
+                               output=output, env=env)
+
+        ps2pdf = ['ps2pdf'] + options['ps2pdf']
+        ps2pdf.append(tools.swapext(filename, 'ps'))
+        ps2pdf_returncode = run(ps2pdf, cwd=compile_dir, timeout=remaining(timeout, start),
+                                output=output, env=env)
 
-            ps2pdf = ['ps2pdf'] + options['ps2pdf']
-            ps2pdf.append(tools.swapext(filename, 'ps'))
-            subprocess.call(ps2pdf, startupinfo=get_startupinfo())
+        returncode = returncode or dvips_returncode or ps2pdf_returncode
 
+    return returncode
 
-@apply
-def default_compile(platform=PLATFORM):
+
+def default_compile(filename, **kwargs) -> int:
+    """Compile LaTeX file with the default engine of the platform."""
     compile_funcs = {'darwin': latexmk_compile,
                      'linux': latexmk_compile,
-                     'windows': texify_compile}
-    return compile_funcs.get(platform, no_compile)
+                     'win32': texify_compile}
+    return compile_funcs.get(sys.platform, no_compile)(filename, **kwargs)
+
+
+def qpdf() -> str:
+    """Return the path of the qpdf executable, raise RuntimeError if not found."""
+    qpdf = which('qpdf')
+    if qpdf is None:
+        raise RuntimeError("failed to find 'qpdf', "
+                           'make sure the qpdf executable '
+                           'is on your systems\' path')
+    return qpdf
+
+
+def _rewrite(filename, args, *, suffix: str, timeout=None, output=None) -> None:
+    """Run qpdf writing to a temporary file, replace filename with the result."""
+    result = f'{filename}.{suffix}'
+    returncode = run([qpdf(), *args, result], timeout=timeout, output=output)
+    if returncode not in (0, 3):  # 3: succeeded with warnings
+        if os.path.exists(result):
+            os.remove(result)
+        raise RuntimeError(f'failed to rewrite {filename!r}: qpdf exited with {returncode}')
+    os.replace(result, filename)
+
+
+def linearize(filename, *, timeout=None, output=None) -> None:
+    """Rewrite PDF file linearized (fast web view) using qpdf."""
+    _rewrite(filename, ['--linearize', filename], suffix='linearized',
+             timeout=timeout, output=output)
+
+
+def splice(filename, segments, *, timeout=None, output=None) -> None:
+    """Rewrite PDF file from (pdf, page range) segments using qpdf.
+
+    Document-level data (info, page labels) is kept from filename.
+    """
+    pages = [arg for pdf, pages in segments for arg in (pdf, pages)]
+    _rewrite(filename, [filename, '--pages', *pages, '--'],
+             suffix='spliced', timeout=timeout, output=output)
+
+
+GHOSTSCRIPT = ('gswin64c', 'gswin32c', 'gs') if sys.platform == 'win32' else ('gs',)
+
+
+def ghostscript() -> str:
+    """Return the path of the Ghostscript executable, raise RuntimeError if not found."""
+    for name in GHOSTSCRIPT:
+        path = which(name)
+        if path is not None:
+            return path
+    raise RuntimeError(f"failed to find {' or '.join(map(repr, GHOSTSCRIPT))}, "
+                       'make sure the Ghostscript executable '
+                       'is on your systems\' path')
+
+
+def optimize_args(*, dpi: int) -> list[str]:
+    """Return the Ghostscript pdfwrite options recompressing and downsampling to dpi."""
+    return ['-dSAFER', '-dBATCH', '-dNOPAUSE', '-dQUIET',
+            '-sDEVICE=pdfwrite',
+            '-dDetectDuplicateImages=true',
+            '-dCompressFonts=true',
+            '-dSubsetFonts=true',
+            '-dDownsampleColorImages=true',
+            '-dDownsampleGrayImages=true',
+            '-dColorImageDownsampleType=/Bicubic',
+            '-dGrayImageDownsampleType=/Bicubic',
+            f'-dColorImageResolution={dpi:d}',
+            f'-dGrayImageResolution={dpi:d}',
+            '-dColorImageDownsampleThreshold=1.0',
+            '-dGrayImageDownsampleThreshold=1.0']
+
+
+def optimize(filename, target, *, dpi: int, timeout=None, output=None) -> int:
+    """Write filename rewritten with Ghostscript pdfwrite to target, return exit status.
+
+    Recompresses streams, downsamples color and grayscale images above dpi,
+    and drops unused objects. Writes target only on success.
+    """
+    tmp = f'{target}.{os.getpid()}.{threading.get_ident()}'
+    cmd = [ghostscript(), *optimize_args(dpi=dpi), f'-sOutputFile={tmp}', filename]
+    try:
+        returncode = run(cmd, timeout=timeout, output=output)
+        if not returncode:
+            os.replace(tmp, target)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return returncode
 
 
 class Npages(object):
 
-    check_cmd: Sequence[str]
-    make_cmd: Callable[[str], Sequence[str]]
+    executable: str
+    make_cmd: Callable[[str, str], Sequence[str]]
     result_pattern: str
 
     _cache = None
@@ -142,35 +400,27 @@ class Npages(object):
         if cls._cache is not None:
             return cls._cache
 
-        tried = []
         for subcls in cls.__subclasses__():
-            try:
-                subprocess.check_call(subcls.check_cmd,
-                                      startupinfo=get_startupinfo())
-            except OSError as e:
-                if e.errno == errno.ENOENT:
-                    tried.append(subcls.check_cmd)
-                else:
-                    raise
-            except subprocess.CalledProcessError:
-                raise RuntimeError
-            else:
+            path = which(subcls.executable)
+            if path is not None:
                 break
         else:
-            tried_msg = ' and '.join(repr(check_cmd) for check_cmd in tried)
-            raise RuntimeError(f'failed to execute {tried_msg}, '
+            tried_msg = ' and '.join(repr(subcls.executable)
+                                     for subcls in cls.__subclasses__())
+            raise RuntimeError(f'failed to find {tried_msg}, '
                                'make sure the pdfinfo or pdftk executable '
                                'is on your systems\' path')
 
-        result = cls._cache = subcls()
+        result = cls._cache = subcls(path)
         return result
 
-    def __init__(self) -> None:
+    def __init__(self, path=None) -> None:
+        self.path = path if path is not None else self.executable
         self.pattern = re.compile(self.result_pattern, re.MULTILINE)
 
     def __call__(self, filename) -> int:
         """Return the number of pages of a PDF by asking pdfinfo/pdftk."""
-        cmd = self.make_cmd(filename)
+        cmd = self.make_cmd(self.path, filename)
         try:
             result = subprocess.check_output(cmd,
                                              stderr=subprocess.STDOUT,
@@ -192,13 +442,13 @@ class Npages(object):
 
 class PDFInfo(Npages):
 
-    check_cmd = ['pdfinfo', '-v']
-    make_cmd = staticmethod(lambda filename: ['pdfinfo', filename])
+    executable = 'pdfinfo'
+    make_cmd = staticmethod(lambda path, filename: [path, filename])
     result_pattern = r'^Pages: +(\d+)'
 
 
 class PDFTk(Npages):
 
-    check_cmd = ['pdftk', '--version']
-    make_cmd = staticmethod(lambda filename: ['pdftk', filename, 'dump_data'])
+    executable = 'pdftk'
+    make_cmd = staticmethod(lambda path, filename: [path, filename, 'dump_data'])
     result_pattern = r'^NumberOfPages: (\d+)'
@@ -0,0 +1,388 @@
+"""Cache .bbl files shared by all parts, keyed on citations, databases, and style.
+
+Run as prefix of latexmk's ``$bibtex``/``$biber`` command (standalone script,
+no package imports): ``python bibcache.py <cachedir> bibtex|biber <command> <file>``.
+
+Shared databases are split into their entries once per build (``write_index()``).
+A part with changed citations runs bibtex/biber on a subset database with only
+the entries it cites (and the ones these cross-reference) instead of the whole
+databases.
+"""
+
+from collections.abc import Iterable, Iterator
+import hashlib
+import html
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+__all__ = ['latexmk_options', 'shared_databases', 'write_index',
+           'split_database', 'subset_databases', 'main']
+
+INDEX = 'databases.json'
+
+SUBSET = '-bibcache'
+
+AUX_LINES = re.compile(rb'^\\(?:citation|bibdata|bibstyle|@input)\{.*$', re.MULTILINE)
+
+AUX_INPUT = re.compile(rb'^\\@input\{([^}]*)\}', re.MULTILINE)
+
+AUX_BIBDATA = re.compile(rb'^\\bibdata\{([^}]*)\}', re.MULTILINE)
+
+AUX_BIBSTYLE = re.compile(rb'^\\bibstyle\{([^}]*)\}', re.MULTILINE)
+
+AUX_CITATION = re.compile(rb'^\\citation\{([^}]*)\}', re.MULTILINE)
+
+BCF_DATASOURCE = re.compile(rb'<bcf:datasource[^>]*>([^<]*)</bcf:datasource>')
+
+BCF_CITEKEY = re.compile(rb'<bcf:citekey[^>]*>([^<]*)</bcf:citekey>')
+
+BIB_BLOCK = re.compile(rb'@[ \t\r\n]*([A-Za-z]+)[ \t\r\n]*([{(])')
+
+BIB_DELIMITER = re.compile(rb'[{}()]')
+
+BIB_XREF = re.compile(r'\b(?:crossref|xref|xdata|related|entryset)\s*=\s*[{"]([^}"]*)[}"]',
+                      re.IGNORECASE)
+
+TEX_BIBLIOGRAPHY = re.compile(r'^[^%\n]*\\(?:bibliography|addbibresource)(?:\[[^]]*\])?\{([^}]*)\}',
+                              re.MULTILINE)
+
+
+def latexmk_options(cache_dir: str) -> list[str]:
+    """Return latexmk options running bibtex and biber through the cache.
+
+    The wrapper is prefixed to the configured commands (e.g. ``bibtex8`` or
+    extra options from a latexmkrc), unless they are latexmk subroutines.
+    """
+    wrapper = f'"{sys.executable}" "{os.path.abspath(__file__)}" "{cache_dir}"'
+    return [arg for tool in ('bibtex', 'biber')
+            for arg in ('-e', f'${tool} = q[{wrapper} {tool} ] . ${tool}'
+                              f' unless ${tool} =~ /^\\s*(?:internal|NONE)\\b/')]
+
+
+def shared_databases(sources: Iterable[str], *,
+                     encoding: str = 'utf-8') -> dict[str, list[str]]:
+    """Return the .bib files used by more than one of the LaTeX sources."""
+    users: dict[str, list[str]] = {}
+    for source in sources:
+        with open(source, encoding=encoding, errors='replace') as fd:
+            data = fd.read()
+        dirname = os.path.dirname(source)
+        for ma in TEX_BIBLIOGRAPHY.finditer(data):
+            for name in ma.group(1).split(','):
+                path = find_file(name.strip(), 'bib', directory=dirname)
+                if path is not None:
+                    users.setdefault(path, []).append(source)
+    return {path: sources for path, sources in users.items() if len(sources) > 1}
+
+
+def write_index(cache_dir: str, databases: Iterable[str]) -> None:
+    """Hash and split the databases once and record them by stat for all part compilations."""
+    os.makedirs(cache_dir, exist_ok=True)
+    index = {path: [*stat_key(path), sha256(path)] for path in databases}
+    for path, (*_, digest) in index.items():
+        split = os.path.join(cache_dir, f'{digest}.bib.json')
+        if not os.path.exists(split):
+            write_atomic(split, json.dumps(split_database(path)).encode('utf-8'))
+    write_atomic(os.path.join(cache_dir, INDEX), json.dumps(index).encode('utf-8'))
+
+
+def split_database(filename: str) -> dict[str, list]:
+    """Return the @string/@preamble blocks and the [key, entry] pairs of a .bib file.
+
+    Text is decoded as latin-1 (round-trips any encoding), @comment blocks and
+    text between blocks are dropped.
+    """
+    with open(filename, 'rb') as fd:
+        data = fd.read()
+    macros, entries = [], []
+    pos = 0
+    while (ma := BIB_BLOCK.search(data, pos)) is not None:
+        pos = block_end(data, ma.end(), b'}' if ma.group(2) == b'{' else b')')
+        block = data[ma.start():pos].decode('latin-1')
+        kind = ma.group(1).lower()
+        if kind in (b'string', b'preamble'):
+            macros.append(block)
+        elif kind != b'comment':
+            key = data[ma.end():pos].split(b',', 1)[0].strip().decode('latin-1')
+            entries.append([key, block])
+    return {'macros': macros, 'entries': entries}
+
+
+def block_end(data: bytes, start: int, close: bytes) -> int:
+    """Return the end of the block opened before start (closing delimiter at brace depth 0)."""
+    depth = 0
+    for ma in BIB_DELIMITER.finditer(data, start):
+        char = ma.group()
+        if char == b'{':
+            depth += 1
+        elif depth == 0 and char == close:
+            return ma.end()
+        elif char == b'}':
+            depth -= 1
+    return len(data)
+
+
+def subset_databases(databases: list[dict[str, list]], keys: Iterable[str]) -> list[str]:
+    """Return the databases reduced to the entries of keys and the ones these reference.
+
+    Keys match case-insensitively, references are followed across databases
+    (crossref, xref, xdata, related, entryset). All @string/@preamble blocks are kept.
+    """
+    by_key: dict[str, list[str]] = {}
+    for database in databases:
+        for key, entry in database['entries']:
+            by_key.setdefault(key.lower(), []).append(entry)
+    wanted = {key.lower() for key in keys}
+    todo = list(wanted)
+    while todo:
+        for entry in by_key.get(todo.pop(), ()):
+            for ma in BIB_XREF.finditer(entry):
+                for ref in ma.group(1).split(','):
+                    ref = ref.strip().lower()
+                    if ref and ref not in wanted:
+                        wanted.add(ref)
+                        todo.append(ref)
+    return ['\n\n'.join(database['macros']
+                        + [entry for key, entry in database['entries'] if key.lower() in wanted])
+            + '\n' for database in databases]
+
+
+def stat_key(path: str) -> list[int]:
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def sha256(filename: str) -> str:
+    h = hashlib.sha256()
+    with open(filename, 'rb') as fd:
+        for data in iter(lambda: fd.read(2 ** 20), b''):
+            h.update(data)
+    return h.hexdigest()
+
+
+def write_atomic(filename: str, data: bytes) -> None:
+    tmp = f'{filename}.{os.getpid()}'
+    with open(tmp, 'wb') as fd:
+        fd.write(data)
+    os.replace(tmp, filename)
+
+
+def find_file(name: str, extension: str, *, directory: str = '') -> str | None:
+    """Return the realpath of name(.extension) in directory or from kpsewhich."""
+    if not name.endswith(f'.{extension}'):
+        name = f'{name}.{extension}'
+    path = os.path.join(directory, name)
+    if os.path.isfile(path):
+        return os.path.realpath(path)
+    try:
+        found = subprocess.run(['kpsewhich', name], cwd=directory or None,
+                               stdin=subprocess.DEVNULL, capture_output=True,
+                               encoding='utf-8').stdout.strip()
+    except OSError:
+        return None
+    return os.path.realpath(found) if found else None
+
+
+def aux_data(filename: str) -> Iterator[bytes]:
+    """Yield the bibtex-relevant lines of an .aux file and the ones it inputs."""
+    with open(filename, 'rb') as fd:
+        data = fd.read()
+    yield from AUX_LINES.findall(data)
+    for ma in AUX_INPUT.finditer(data):
+        subaux = ma.group(1).decode('utf-8', 'replace')
+        if os.path.isfile(subaux):
+            yield from aux_data(subaux)
+
+
+def load_index(cache_dir: str) -> dict[str, list]:
+    """Return the databases recorded by write_index() (empty if missing or unreadable)."""
+    try:
+        with open(os.path.join(cache_dir, INDEX), encoding='utf-8') as index_fd:
+            return json.load(index_fd)
+    except (OSError, ValueError):
+        return {}
+
+
+def read_input(tool: str, base: str) -> tuple[bytes, list[str], list[str | None], list[str | None]]:
+    """Return the citation data of base, its database names, database files, and style files."""
+    if tool == 'biber':
+        with open(f'{base}.bcf', 'rb') as fd:
+            data = fd.read()
+        names = [n.decode('utf-8', 'replace') for n in BCF_DATASOURCE.findall(data)]
+        styles = []
+    else:
+        data = b'\n'.join(aux_data(f'{base}.aux'))
+        names = [n.strip() for ma in AUX_BIBDATA.findall(data)
+                 for n in ma.decode('utf-8', 'replace').split(',')]
+        styles = [find_file(ma.decode('utf-8', 'replace').strip(), 'bst')
+                  for ma in AUX_BIBSTYLE.findall(data)]
+    return data, names, [find_file(n, 'bib') for n in names], styles
+
+
+def cache_key(index: dict[str, list], tool: str, args: list[str], data: bytes,
+              files: list[str | None]) -> str | None:
+    """Return the cache key for running tool on data (None if not cacheable)."""
+    def database_hash(path):
+        mtime, size, digest = index.get(path, (None, None, None))
+        return digest if [mtime, size] == stat_key(path) else sha256(path)
+
+    if None in files:
+        return None
+    h = hashlib.sha256(json.dumps([tool, args]).encode('utf-8'))
+    h.update(data)
+    for path in files:
+        h.update(database_hash(path).encode('ascii'))
+    return h.hexdigest()
+
+
+def read_subsets(cache_dir: str, index: dict[str, list], tool: str, data: bytes,
+                 files: list[str | None]) -> list[str] | None:
+    """Return the subset databases for the cited keys of data.
+
+    None if any database was not split for this build or everything is cited.
+    """
+    pattern = BCF_CITEKEY if tool == 'biber' else AUX_CITATION
+    keys = {key.strip() for ma in pattern.findall(data)
+            for key in ma.decode('latin-1').split(',')}
+    if '*' in keys:
+        return None
+    databases = []
+    for path in files:
+        if path is None:
+            return None
+        mtime, size, digest = index.get(path, (None, None, None))
+        if [mtime, size] != stat_key(path):
+            return None
+        try:
+            with open(os.path.join(cache_dir, f'{digest}.bib.json'), encoding='utf-8') as fd:
+                databases.append(json.load(fd))
+        except (OSError, ValueError):
+            return None
+    return subset_databases(databases, keys - {''})
+
+
+def run_subset(args: list[str], tool: str, base: str, data: bytes,
+               names: list[str], subsets: list[str]) -> int:
+    """Run the command on a copy of the .aux/.bcf reading the subset databases.
+
+    Writes the .bbl and .blg of base (with the original database names in the
+    log, which latexmk parses for dependencies) and removes the copies.
+    """
+    tmp = f'{base}{SUBSET}'
+    bibs = [f'{tmp}-{i:d}.bib' for i in range(len(subsets))]
+    control = f'{tmp}.bcf' if tool == 'biber' else f'{tmp}.aux'
+    try:
+        for bib, subset in zip(bibs, subsets):
+            write_atomic(bib, subset.encode('latin-1'))
+        if tool == 'biber':
+            sources = iter(html.escape(os.path.abspath(bib), quote=False).encode('utf-8')
+                           for bib in bibs)
+
+            def datasource(ma):
+                (start, end) = (ma.start(1) - ma.start(), ma.end(1) - ma.start())
+                return ma.group()[:start] + next(sources) + ma.group()[end:]
+
+            data = BCF_DATASOURCE.sub(datasource, data)
+        else:
+            bibdata = iter(os.fsencode(os.path.splitext(bib)[0]) for bib in bibs)
+
+            def database(ma):
+                return b'\\bibdata{%s}' % b','.join(next(bibdata) for _ in ma.group(1).split(b','))
+
+            lines = [line for line in data.splitlines() if not line.startswith(b'\\@input{')]
+            data = AUX_BIBDATA.sub(database, b'\n'.join(lines) + b'\n')
+        write_atomic(control, data)
+
+        returncode = subprocess.call([*args[:-1], tmp])
+
+        for ext in ('bbl', 'blg'):
+            if not os.path.exists(f'{tmp}.{ext}'):
+                continue
+            with open(f'{tmp}.{ext}', 'rb') as fd:
+                output = fd.read()
+            if ext == 'blg':
+                for bib, name in zip(bibs, names):
+                    original = os.fsencode(name if name.endswith('.bib') else f'{name}.bib')
+                    output = output.replace(os.fsencode(os.path.abspath(bib)), original)
+                    output = output.replace(os.fsencode(bib), original)
+                output = output.replace(os.fsencode(os.path.basename(tmp)),
+                                        os.fsencode(os.path.basename(base)))
+            write_atomic(f'{base}.{ext}', output)
+    finally:
+        for path in [*bibs, control, f'{tmp}.bbl', f'{tmp}.blg']:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    return returncode
+
+
+def replace_if_changed(source: str, target: str) -> None:
+    with open(source, 'rb') as fd:
+        data = fd.read()
+    try:
+        with open(target, 'rb') as fd:
+            if fd.read() == data:
+                return
+    except OSError:
+        pass
+    write_atomic(target, data)
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Run the bibtex/biber command unless the cache holds the result for the same input.
+
+    Runs it on subset databases if all its databases were split for this build.
+    """
+    (cache_dir, tool, *args) = sys.argv[1:] if argv is None else argv
+    (*options, filename) = args
+    (base, ext) = os.path.splitext(filename)
+    if ext not in ('.aux', '.bcf'):
+        base = filename
+
+    index = load_index(cache_dir)
+    try:
+        data, names, files, styles = read_input(tool, base)
+        key = cache_key(index, tool, options, data, files + styles)
+    except OSError:
+        key = None
+
+    cached = os.path.join(cache_dir, key) if key is not None else None
+    if cached is not None:
+        try:
+            with open(f'{cached}.json', encoding='utf-8') as fd:
+                returncode = json.load(fd)['returncode']
+        except (OSError, ValueError):
+            pass
+        else:
+            for ext in ('bbl', 'blg'):
+                if os.path.exists(f'{cached}.{ext}'):
+                    replace_if_changed(f'{cached}.{ext}', f'{base}.{ext}')
+            print(f'latexpages: {tool} input of {filename} unchanged, using cached {base}.bbl')
+            return returncode
+
+    subsets = (read_subsets(cache_dir, index, tool, data, files)
+               if key is not None and not os.path.isabs(base) else None)
+    if subsets is not None:
+        print(f'latexpages: {tool} on {filename} reading only cited entries'
+              f' of {len(subsets)} database(s)')
+        returncode = run_subset(args, tool, base, data, names, subsets)
+    else:
+        returncode = subprocess.call(args)
+
+    if cached is not None and returncode in (0, 1) and os.path.exists(f'{base}.bbl'):
+        os.makedirs(cache_dir, exist_ok=True)
+        for ext in ('bbl', 'blg'):
+            if os.path.exists(f'{base}.{ext}'):
+                shutil.copyfile(f'{base}.{ext}', f'{cached}.{ext}.{os.getpid()}')
+                os.replace(f'{cached}.{ext}.{os.getpid()}', f'{cached}.{ext}')
+        write_atomic(f'{cached}.json', json.dumps({'returncode': returncode}).encode('utf-8'))
+    return returncode
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,68 +1,506 @@
 """Compile parts, copy to output, combine, combine two_up."""
 
+import contextlib
+import functools
+import json
 import multiprocessing
 import os
 import shutil
+import subprocess
+import time
+import typing
 
 from . import backend
+from . import bibcache
 from . import jobs
+from . import manifest
 from . import pdfpages
+from . import stats
+from . import texcache
 from . import tools
 
 __all__ = ['make']
 
+OK = 'ok'
+
+FAILED = 'failed'
+
+TIMEOUT = 'timeout'
+
+PAGE_PRESERVING = frozenset({'fitpaper'})
+
+MAX_REPEAT = 'Maximum runs of'
+
+RETURN_CODE = 'gave return code'
+
 
 def make(config, *,
-         processes=None, engine=None, cleanup=True, only=None) -> None:
-    """Compile parts, copy, and combine as instructed in config file."""
-    job = jobs.Job(config, processes=processes, engine=engine, cleanup=cleanup)
+         processes=None, engine=None, cleanup=True, only=None, combine=False,
+         timeout=None, retries=None, draft=False, threads=None, pool=None) -> bool:
+    """Compile parts, copy, and combine as instructed in config file.
+
+    Return if all parts compiled. If any part failed or timed out,
+    nothing is copied or combined.
+
+    If only is given (part names or glob patterns), compile only the
+    matching parts, and if combine is true, copy them (and other part
+    PDFs changed since they were copied) and recombine reusing the
+    existing PDFs of all other parts.
+
+    If draft is true, compile parts with the options of the draft
+    section (e.g. graphics draft, fewer passes) into separate PDFs and
+    combine them into the draft directory instead of the output directory.
+
+    If threads is true, run compilations in threads of this process
+    instead of worker processes.
+
+    If pool is given, run compilations with it (ignoring processes)
+    and leave it open, e.g. to share one pool between several builds.
+    """
+    job = jobs.Job(config, processes=processes, engine=engine, cleanup=cleanup,
+                   timeout=timeout, retries=retries, draft=draft, threads=threads)
+
+    if job.linearize or job.splice:
+        backend.qpdf()
+    if job.optimize:
+        backend.ghostscript()
+
+    if job.bibcache:
+        prepare_bibcache(job)
+
+    if job.warmup:
+        texcache.warmup(timeout=job.timeout)
+    if job.isolate_cache:
+        job.texmf_var = texcache.texmfvar()
+        if (job.warmup and job.texmf_var is not None
+                and texcache.update_generation(job.texmf_var)):
+            print(f'latexpages: reseeding TEXMFVAR copies from {job.texmf_var}')
 
     if only is not None:
-        args = job.to_compile_only(only)
-        compile_part(args)
-        return
+        to_compile = job.to_compile_only(only)
+        if not combine:
+            job.processes = min(job.processes or os.cpu_count() or 1, len(to_compile))
+    else:
+        to_compile, combine = None, True
 
-    pool_cls = multiprocessing.Pool if job.processes != 1 else tools.NullPool
-    pool = pool_cls(job.processes, tools.ignore_sigint)
+    if pool is not None:
+        return make_parts(job, pool, only=to_compile, combine=combine)
 
-    try:
-        pool.map(compile_part, job.to_compile(), chunksize=1)
-        copy_parts(job)
-        pool.map(combine_parts, job.to_combine(), chunksize=1)
-    except KeyboardInterrupt:  # https://bugs.python.org/issue8296
-        pool.terminate()
+    pool_cls: typing.Callable[..., typing.Any]
+    if job.threads:
+        pool_cls = tools.ThreadPool
     else:
-        pool.close()
+        pool_cls = multiprocessing.Pool if job.processes != 1 else tools.NullPool
+    pool = pool_cls(job.processes, tools.init_worker)
+
+    with tools.exit_on_term():
+        try:
+            ok = make_parts(job, pool, only=to_compile, combine=combine)
+        except KeyboardInterrupt:  # https://bugs.python.org/issue8296
+            pool.terminate()
+            ok = False
+        except BaseException:  # e.g. SystemExit on SIGTERM, kill running compilations
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+    return ok
+
+
+def make_parts(job, pool, *, only=None, combine=True) -> bool:
+    """Compile parts (or only the given ones), copy, and combine using the given pool."""
+    to_compile = list(job.to_compile()) if only is None else only
+    results = [print_output(r) for r in
+               pool.imap_unordered(compile_part, to_compile, chunksize=1)]
+    report(results, timeout=job.timeout)
+    failed = [r.part for r in results if r.status != OK]
+    if failed:
+        if combine:
+            print(f'latexpages: not copying or combining, {len(failed)} part(s) failed')
+        return False
+    if not combine:
+        return True
+
+    old = manifest.Manifest.load(os.path.join(job.config_dir, job.manifest))
+    entries = describe_parts(job, pool, old)
+    with tools.lock(job.config_dir) as waited:
+        if waited:
+            print(f'latexpages: waited for lock on {job.directory!r}')
+        describe_outputs(job, old, entries)
+        copy_parts(job, entries)
+        to_combine = [c for c in job.to_combine() if not up_to_date(job, c, old, entries)]
+        if job.splice:
+            to_combine = [c for c in to_combine if not splice_parts(job, c, old, entries)]
+        tasks = [combine_task(job, c) for c in to_combine]
+        combined = [print_output(r) for r in
+                    pool.imap_unordered(combine_parts, tasks, chunksize=1)]
+        failed = [r.part for r in combined if r.status != OK]
+        for name in failed:
+            print(f'latexpages: combining {name}.pdf failed')
+        write_manifest(job, results, old, entries, failed=failed)
+    return not failed
+
+
+def prepare_bibcache(job) -> None:
+    """Run bibtex/biber through the shared .bbl cache, hash and split shared databases once."""
+    cache_dir = tools.cache_dir('bibcache')
+    shared = bibcache.shared_databases(job.to_sources())
+    for path, sources in shared.items():
+        print(f'latexpages: {path} shared by {len(sources)} parts')
+    bibcache.write_index(cache_dir, shared)
+    job.compile_opts['latexmk'] = (job.compile_opts['latexmk']
+                                   + bibcache.latexmk_options(cache_dir))
+
+
+def environ(variables) -> dict[str, str] | None:
+    """Return os.environ updated with variables (None if there are none)."""
+    return dict(os.environ, **variables) if variables else None
+
+
+def compile_part(task: jobs.CompileTask) -> stats.Stats:
+    """Compile part LaTeX document to PDF, return its compile statistics."""
+    start = time.monotonic()
+    texmf_var = (texcache.overlay(task.texmf_var, env=environ(task.environ))
+                 if task.isolate_cache else contextlib.nullcontext(environ(task.environ)))
+    directory = os.path.join(task.config_dir, task.part)
+    pdf = os.path.join(directory, f'{task.jobname}.pdf')
+    with tools.lock(directory) as waited, texmf_var as env:
+        for _ in range(task.retries + 1):
+            output: list[tuple[float, str]] = []
+            if waited:
+                output.append((time.monotonic(),
+                               'latexpages: waited for concurrent compilation'))
+            try:
+                returncode = backend.compile(os.path.join(directory, f'{task.part}.tex'),
+                                             dvips=task.dvips,
+                                             engine=task.engine,
+                                             options=task.options,
+                                             timeout=task.timeout,
+                                             output=output, env=env)
+            except subprocess.TimeoutExpired:
+                status = TIMEOUT
+            else:
+                status = FAILED if returncode else OK
+                if status == FAILED and task.accept_max_repeat and max_repeat_reached(output, pdf):
+                    output.append((time.monotonic(),
+                                   'latexpages: maximum runs reached, accepting draft PDF'))
+                    status = OK
+                if status == OK:
+                    break
+        end = time.monotonic()
+        sizes = None
+        if status == OK and task.optimize_dpi is not None:
+            sizes = optimize_part(pdf, dpi=task.optimize_dpi, timeout=task.timeout,
+                                  output=output)
+        return stats.Stats.from_compile(task.part, status, end - start, output,
+                                        os.path.join(directory, f'{task.jobname}.log'),
+                                        end=end, sizes=sizes)
+
+
+def max_repeat_reached(output, pdf: str) -> bool:
+    """Return if latexmk failed only for reaching $max_repeat and the PDF was written."""
+    lines = [line for _, line in output]
+    return (any(MAX_REPEAT in line for line in lines)
+            and not any(RETURN_CODE in line for line in lines)
+            and os.path.exists(pdf))
+
+
+def optimized_pdf(pdf_sha256: str, *, dpi: int) -> str:
+    """Return the cache path of the optimized version of a part PDF."""
+    key = [pdf_sha256, backend.optimize_args(dpi=dpi)]
+    return tools.cache_dir('optimized', f'{manifest.sha256_text(json.dumps(key))}.pdf')
+
+
+def optimize_part(filename: str, *, dpi: int, timeout=None,
+                  output=None) -> tuple[int, int] | None:
+    """Optimize a part PDF into the cache (unless cached), return the sizes before/after."""
+    cached = optimized_pdf(manifest.sha256(filename), dpi=dpi)
+    if not os.path.exists(cached):
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        try:
+            returncode = backend.optimize(filename, cached, dpi=dpi,
+                                          timeout=timeout, output=output)
+        except subprocess.TimeoutExpired:
+            status = TIMEOUT
+        else:
+            status = f'{FAILED} ({returncode:d})' if returncode else OK
+        if status != OK:
+            if output is not None:
+                output.append((time.monotonic(), f'latexpages: optimizing {status}'))
+            return None
+    return os.path.getsize(filename), os.path.getsize(cached)
+
+
+def print_output(result: stats.Stats) -> stats.Stats:
+    """Print the captured console output of a compiled part at once."""
+    if result.output:
+        print('\n'.join(f'{result.part}: {line}' for line in result.output))
+    return result
+
+
+def report(results, *, timeout=None) -> None:
+    """Print the compile statistics table and the parts that failed or timed out."""
+    print(stats.format_table(results))
+    for r in results:
+        if r.sizes is not None:
+            print(f'latexpages: {r.part!r} optimized {r.size_summary()}')
+        if r.status == TIMEOUT:
+            print(f'latexpages: {r.part!r} timed out after {timeout} seconds')
+        elif r.status == FAILED:
+            print(f'latexpages: {r.part!r} failed')
+
+
+def describe_parts(job, pool, old) -> list[dict]:
+    """Return the manifest entries, reusing the ones of unchanged parts.
+
+    A part is unchanged if its source, PDF, and directory have the same
+    modification time and size as recorded in the last make.
+    """
+    path = functools.partial(os.path.join, job.config_dir)
+    entries = {}
+    for _, part, source, pdf, _ in job.to_describe():
+        entry = old.parts.get(part)
+        if (entry is not None
+                and entry.get('source_stat') == manifest.stat_key(path(source))
+                and entry['pdf_stat'] == manifest.stat_key(path(pdf))
+                and entry['dir_stat'] == manifest.stat_key(path(part))):
+            entries[part] = entry
+    to_describe = [args for args in job.to_describe() if args[1] not in entries]
+    for entry in pool.map(manifest.describe_part, to_describe, chunksize=1):
+        entries[entry['part']] = entry
+    return [entries[part] for _, part, *_ in job.to_describe()]
+
+
+def copy_parts(job, entries) -> None:
+    """Copy part PDFs to the output directory where the copy differs (by hash).
+
+    If optimize is on, copy the cached optimized PDF instead where it is smaller.
+    Updates hash and stat of the copies in the part entries.
+    """
+    path = functools.partial(os.path.join, job.config_dir)
+    if not os.path.isdir(path(job.directory)):
+        os.mkdir(path(job.directory))
+    for entry in entries:
+        source = optimized_source(job, path(entry['pdf']), entry)
+        source_sha256 = (entry['pdf_sha256'] if source == path(entry['pdf'])
+                         else manifest.sha256(source))
+        if entry['output_sha256'] == source_sha256:
+            continue
+        with tools.lock(path(entry['part'])):
+            shutil.copyfile(source, path(entry['output']))
+        entry['output_sha256'] = source_sha256
+        entry['output_stat'] = manifest.stat_key(path(entry['output']))
+
+
+def describe_outputs(job, old, entries) -> None:
+    """Record hash and stat of the output directory copies in the part entries.
+
+    These are the files the combined PDFs include (the part PDF or its
+    optimized version). Reuses the hashes of copies unchanged since the last make.
+    """
+    for entry in entries:
+        target = os.path.join(job.config_dir, entry['output'])
+        stat = manifest.stat_key(target)
+        previous = old.parts.get(entry['part'], {})
+        if stat is not None and stat == previous.get('output_stat'):
+            entry['output_sha256'] = previous['output_sha256']
+        else:
+            entry['output_sha256'] = manifest.sha256(target) if stat is not None else None
+        entry['output_stat'] = stat
+
+
+def optimized_source(job, filename: str, entry=None) -> str:
+    """Return the cached optimized PDF if optimize is on and it is smaller, else filename."""
+    if not job.optimize:
+        return filename
+    pdf_sha256 = entry['pdf_sha256'] if entry is not None else manifest.sha256(filename)
+    cached = optimized_pdf(pdf_sha256, dpi=job.optimize_dpi)
+    if os.path.exists(cached) and os.path.getsize(cached) < os.path.getsize(filename):
+        return cached
+    return filename
+
+
+class CombineTask(typing.NamedTuple):
+    """Compact description of a combination sent to the workers."""
+
+    directory: str
+
+    name: str
+
+    document: pdfpages.Source
+
+    two_up: bool
+
+    engine: str | None
+
+    options: dict[str, list[str]]
+
+    environ: dict[str, str]
+
+    cleanup: bool
+
+    linearize: bool
+
+
+def combine_source(job, combination: jobs.Combination) -> pdfpages.Source:
+    """Return the pdfpages document combining the output PDFs."""
+    return pdfpages.Source([p.output for p in combination.prelims],
+                           [p.output for p in combination.mainmatter],
+                           context=job.context, template=combination.template,
+                           includepdfopts=job.includepdfopts,
+                           documentclass=job.documentclass,
+                           documentopts=job.documentopts)
+
+
+def combine_task(job, combination: jobs.Combination) -> CombineTask:
+    return CombineTask(os.path.join(job.config_dir, job.directory), combination.name,
+                       combine_source(job, combination), combination.two_up,
+                       job.engine, job.compile_opts, job.environ(),
+                       job.cleanup, job.linearize)
+
+
+def combine_parts(task: CombineTask) -> stats.Stats:
+    """Combine output PDFs with pdfpages, return the status and captured console output."""
+    start = time.monotonic()
+    output: list[tuple[float, str]] = []
+    filename = os.path.join(task.directory, task.name)
+    returncode = task.document.render(tools.swapext(filename, 'tex'),
+                                      two_up=task.two_up, engine=task.engine,
+                                      options=task.options, env=environ(task.environ),
+                                      output=output, cleanup=task.cleanup)
+    if not returncode and task.linearize:
+        backend.linearize(tools.swapext(filename, 'pdf'), output=output)
+    return stats.Stats(task.name, FAILED if returncode else OK, time.monotonic() - start,
+                       output=[line for _, line in output])
+
+
+def combine_key(job, combination: jobs.Combination, entries) -> str:
+    """Return the hash of everything determining the bytes of a combined PDF."""
+    by_part = {entry['part']: entry for entry in entries}
+    key = [combine_source(job, combination).source(two_up=combination.two_up),
+           job.engine, job.compile_opts, job.linearize,
+           job.environ().get('SOURCE_DATE_EPOCH'),
+           job.optimize and backend.optimize_args(dpi=job.optimize_dpi),
+           [by_part[part.name]['output_sha256'] for part in combination.parts]]
+    return manifest.sha256_text(json.dumps(key))
+
+
+def up_to_date(job, combination: jobs.Combination, old, entries) -> bool:
+    """Return if the combined PDF is unchanged and was made from the same inputs."""
+    previous = old.combined.get(combination.name)
+    if (previous is None
+            or previous.get('combine_key') != combine_key(job, combination, entries)):
+        return False
+    if previous['stat'] != manifest.stat_key(os.path.join(job.config_dir, previous['pdf'])):
+        return False
+    print(f'latexpages: {combination.name}.pdf is up to date')
+    return True
+
+
+def page_map(combination: jobs.Combination, entries) -> list[list] | None:
+    """Return [part, first page, page count] of the combined parts (None if unknown)."""
+    by_part = {entry['part']: entry for entry in entries}
+    result = []
+    first = 1
+    for part in combination.parts:
+        pages = by_part[part.name]['pages']
+        if pages is None:
+            return None
+        result.append([part.name, first, pages])
+        first += pages
+    return result
+
+
+def page_preserving(job, combination: jobs.Combination) -> bool:
+    """Return if combining puts the part pages into the combined PDF as they are.
+
+    True only for the default template with exactly the fitpaper include option
+    (no scaling, offsets, page commands, or decorations from a custom template).
+    """
+    options = {o.strip() for o in job.includepdfopts[combination.two_up].split(',')}
+    return combination.template is None and options == PAGE_PRESERVING
+
+
+def splice_parts(job, combination: jobs.Combination, old, entries) -> bool:
+    """Replace the pages of changed parts in the combined PDF, return if done.
+
+    Only possible if combining preserves the part pages, no part changed its
+    page count, the combining document is the same, and the combined PDF is
+    unchanged since the last make.
+    """
+    previous = old.combined.get(combination.name)
+    if (combination.two_up or not page_preserving(job, combination)
+            or previous is None or previous.get('page_map') is None):
+        return False
+
+    pdf = os.path.join(job.config_dir, previous['pdf'])
+    pages = page_map(combination, entries)
+    source = combine_source(job, combination).source()
+    if (pages is None or pages != previous['page_map']
+            or previous['pages'] != sum(count for _, _, count in pages)
+            or previous['source_sha256'] != manifest.sha256_text(source)
+            or previous['stat'] != manifest.stat_key(pdf)):
+        return False
+
+    by_part = {entry['part']: entry for entry in entries}
+    changed = {part for part, _, _ in pages
+               if (by_part[part]['output_sha256']
+                   != old.parts.get(part, {}).get('output_sha256'))}
+    if not changed:
+        return False
+
+    segments = []
+    for part, first, count in pages:
+        last = first + count - 1
+        if part in changed:
+            target = job.target(job.parts[part])
+            segments.append((os.path.join(job.config_dir, target), 1, count))
+        elif segments and segments[-1][0] == pdf:
+            segments[-1] = (pdf, segments[-1][1], last)
+        else:
+            segments.append((pdf, first, last))
+
+    print(f'latexpages: splicing {", ".join(sorted(changed))} into {combination.name}.pdf')
+    output: list[tuple[float, str]] = []
+    try:
+        backend.splice(pdf, [(f, f'{first:d}-{last:d}') for f, first, last in segments],
+                       output=output)
+        if job.linearize:
+            backend.linearize(pdf, output=output)
     finally:
-        pool.join()
-
-
-def compile_part(args) -> None:
-    """Compile part LaTeX document to PDF."""
-    (job, part, filename, dvips) = args
-    with tools.chdir(job.config_dir, part):
-        backend.compile(filename, dvips=dvips, engine=job.engine,
-                        options=job.compile_opts)
-
-
-def copy_parts(job) -> None:
-    """Copy part PDFs to the output directory."""
-    with tools.chdir(job.config_dir):
-        if not os.path.isdir(job.directory):
-            os.mkdir(job.directory)
-        for source, target in job.to_copy():
-            shutil.copyfile(source, target)
-
-
-def combine_parts(args) -> None:
-    """Combine output PDFs with pdfpages."""
-    (job, outname, template, prelims, filenames, two_up) = args
-    with tools.chdir(job.config_dir, job.directory):
-        document = pdfpages.Source(prelims, filenames,
-                                   context=job.context, template=template,
-                                   includepdfopts=job.includepdfopts,
-                                   documentclass=job.documentclass,
-                                   documentopts=job.documentopts)
-        document.render(tools.swapext(outname, 'tex'),
-                        two_up=two_up, engine=job.engine,
-                        options=job.compile_opts, cleanup=job.cleanup)
+        for _, line in output:
+            print(f'{combination.name}: {line}')
+    return True
+
+
+def write_manifest(job, results, old, entries, *, failed=()) -> None:
+    """Record the built parts and combined outputs in the output directory.
+
+    Failed combinations are left out, so the next make combines them again.
+    Entries of combined PDFs unchanged since the last make are reused.
+    """
+    durations = {r.part: r.duration for r in results}
+    for entry in entries:
+        if entry['part'] in durations or 'duration' not in entry:
+            entry['duration'] = durations.get(entry['part'])
+    combined = []
+    for c in job.to_combine():
+        if c.name in failed:
+            continue
+        key = combine_key(job, c, entries)
+        previous = old.combined.get(c.name)
+        if (previous is not None and previous.get('combine_key') == key
+                and previous['stat'] == manifest.stat_key(os.path.join(job.config_dir,
+                                                                       previous['pdf']))):
+            combined.append(previous)
+            continue
+        source = combine_source(job, c).source(two_up=c.two_up)
+        pages = None if c.two_up else page_map(c, entries)
+        combined.append(manifest.describe_combined(job.config_dir, job.directory, c.name,
+                                                   source_sha256=manifest.sha256_text(source),
+                                                   combine_key=key,
+                                                   page_map=pages))
+    manifest.Manifest(entries, combined,
+                      directory=job.directory).save(os.path.join(job.config_dir, job.manifest))
@@ -1,49 +1,67 @@
 """Remove intermediate and/or output files."""
 
-from collections.abc import Iterator, Sequence
+from collections.abc import Callable, Iterator, Sequence
 import fnmatch
 import functools
+import itertools
 import os
 import shutil
 
 from . import jobs
+from . import manifest
 from . import tools
 
 __all__ = ['clean']
 
 
-def clean(config, *, clean_output: bool | None = None) -> None:
+def clean(config, *, clean_output: bool | None = None,
+          confirm: bool = True) -> None:
     job = jobs.Job(config)
-    with tools.chdir(job.config_dir):
-        in_parts = list(matched_files(job.to_clean(), job.clean_parts, job.clean_except))
-        if job.clean_output or clean_output:
-            in_output = list(output_files(job.directory))
-            if not in_parts and not in_output:
-                return
-            print('\n'.join(in_parts))
-            print('\n'.join(in_output))
-            msg = (f'...delete {len(in_parts)} files matched in parts'
-                   f' and {len(in_output)} files removing {job.directory}?')
-            if tools.confirm(msg):
-                remove(in_parts, directory=job.directory)
-        elif in_parts:
-            print('\n'.join(in_parts))
-            if tools.confirm(f'...delete {len(in_parts)} files matched in parts?'):
-                remove(in_parts)
+    confirmed = tools.confirm if confirm else lambda question: True
+    root = job.config_dir
+    built = manifest.Manifest.load(os.path.join(root, job.manifest), root=root)
+    in_parts = list(matched_files(job.to_clean(), job.clean_parts, job.clean_except,
+                                  listdir=built.part_files, root=root))
+    if job.clean_output or clean_output:
+        in_output = built.output_files(job.directory)
+        if in_output is None:
+            in_output = list(output_files(job.directory, root=root))
+        if not in_parts and not in_output:
+            return
+        print('\n'.join(in_parts))
+        print('\n'.join(in_output))
+        msg = (f'...delete {len(in_parts)} files matched in parts'
+               f' and {len(in_output)} files removing {job.directory}?')
+        if confirmed(msg):
+            with tools.lock(root):
+                remove(in_parts, directory=job.directory, root=root)
+    elif in_parts:
+        print('\n'.join(in_parts))
+        if confirmed(f'...delete {len(in_parts)} files matched in parts?'):
+            remove(in_parts, root=root)
 
 
 def matched_files(dirs: Sequence[os.PathLike[str] | str],
                   patterns: Sequence[str],
-                  except_patterns: Sequence[str]) -> Iterator[str]:
+                  except_patterns: Sequence[str], *,
+                  listdir: Callable[[os.PathLike[str] | str], list[str] | None] | None = None,
+                  root: os.PathLike[str] | str = '') -> Iterator[str]:
+    """Yield files in dirs (relative to root) matching patterns but not except_patterns.
+
+    If listdir returns a list of files for a directory (e.g. from the
+    manifest of the last make), use it instead of listing the directory.
+    """
     for d in dirs:
         if os.path.isabs(d):
             raise ValueError(f'non-relative path: {d!r}')
 
-        for f in sorted(os.listdir(d)):
-            path = os.path.join(d, f)
-            if not os.path.isfile(path):
-                continue
+        files = listdir(d) if listdir is not None else None
+        if files is None:
+            files = [f for f in sorted(os.listdir(os.path.join(root, d)))
+                     if os.path.isfile(os.path.join(root, d, f))]
 
+        for f in files:
+            path = os.path.join(d, f)
             path_matches = functools.partial(fnmatch.fnmatch, path)
             match = (any(map(path_matches, patterns))
                      and not any(map(path_matches, except_patterns)))
@@ -51,18 +69,22 @@ def matched_files(dirs: Sequence[os.PathLike[str] | str],
                 yield path
 
 
-def output_files(directory: os.PathLike[str] | str) -> Iterator[str]:
+def output_files(directory: os.PathLike[str] | str, *,
+                 root: os.PathLike[str] | str = '') -> Iterator[str]:
     if os.path.isabs(directory):
         raise ValueError(f'non-relative path: {directory!r}')
 
-    for root, dirs, files in os.walk(directory):
+    for dirpath, dirs, files in os.walk(os.path.join(root, directory)):
         for f in sorted(files):
-            yield os.path.join(root, f)
+            yield os.path.relpath(os.path.join(dirpath, f), root or os.curdir)
 
 
 def remove(files: Sequence[os.PathLike[str] | str], *,
-           directory: os.PathLike[str] | str | None = None) -> None:
-    for f in files:
-        os.remove(f)
+           directory: os.PathLike[str] | str | None = None,
+           root: os.PathLike[str] | str = '') -> None:
+    for dirname, dir_files in itertools.groupby(files, key=os.path.dirname):
+        with tools.lock(root, dirname):
+            for f in dir_files:
+                os.remove(os.path.join(root, f))
     if directory is not None:
-        shutil.rmtree(directory)
+        shutil.rmtree(os.path.join(root, directory))
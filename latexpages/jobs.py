@@ -1,13 +1,67 @@
 """Parse .ini-style config file into function call args."""
 
 import configparser
+import fnmatch
 import functools
 import os
 import shlex
+import typing
 
+from . import manifest
+from . import partlist
 from . import tools
 
-__all__ = ['Job']
+__all__ = ['Job', 'CompileTask', 'Combination']
+
+DRAFT_SUFFIX = '_draft'
+
+
+class CompileTask(typing.NamedTuple):
+    """Compact description of a part compilation sent to the workers."""
+
+    config_dir: str
+
+    part: str
+
+    jobname: str
+
+    dvips: bool
+
+    engine: str | None
+
+    options: dict[str, list[str]]
+
+    timeout: int | None
+
+    retries: int
+
+    environ: dict[str, str]
+
+    isolate_cache: bool
+
+    texmf_var: str | None
+
+    optimize_dpi: int | None
+
+    accept_max_repeat: bool
+
+
+class Combination(typing.NamedTuple):
+    """Combined output PDF with the parts to include."""
+
+    name: str
+
+    template: str | None
+
+    prelims: tuple[partlist.Part, ...]
+
+    mainmatter: tuple[partlist.Part, ...]
+
+    two_up: bool
+
+    @property
+    def parts(self) -> tuple[partlist.Part, ...]:
+        return self.prelims + self.mainmatter
 
 
 def get_string(config, section, option, *,
@@ -61,7 +115,7 @@ class Job(object):
     _defaults = tools.current_path('settings.ini')
 
     _sections = ('make', 'parts', 'template', 'substitute', 'compile',
-                 'paginate', 'clean')
+                 'draft', 'paginate', 'clean')
 
     _get_string = staticmethod(get_string)
 
@@ -79,20 +133,22 @@ class Job(object):
             return default
 
     def __init__(self, filename, *,
-                 processes=None, engine=None, cleanup=True) -> None:
+                 processes=None, engine=None, cleanup=True,
+                 timeout=None, retries=None, draft=False, threads=None) -> None:
         cfg = configparser.ConfigParser()
         if not os.path.exists(filename):
             raise ValueError(f'file not found: {filename!r}')
         parsed = cfg.read([self._defaults, filename])
         assert len(parsed) == 2
 
-        self.config_dir = os.path.dirname(filename)
+        self.config_dir = os.path.abspath(os.path.dirname(filename))
 
         partial = functools.partial
         for section in self._sections:
             getters = {
                 'string': partial(self._get_string, cfg, section),
                 'quoted_string': partial(self._get_quoted_string, cfg, section),
+                'integer': partial(self._get_int, cfg, section),
                 'lst': partial(self._get_list, cfg, section),
                 'boolean': partial(cfg.getboolean, section),
                 'items': partial(cfg.items, section),
@@ -103,44 +159,71 @@ class Job(object):
             processes = self._get_int(cfg, 'compile', 'processes', optional=True)
         if engine is None:
             engine = self._get_string(cfg, 'compile', 'engine', optional=True)
-
+        if timeout is None:
+            timeout = self._get_int(cfg, 'compile', 'timeout', optional=True)
+        if retries is None:
+            retries = self._get_int(cfg, 'compile', 'retries')
+        if threads is None:
+            threads = cfg.getboolean('compile', 'threads')
+
+        if draft:
+            if engine == 'texify':
+                raise ValueError('draft mode requires latexmk')
+            engine = 'latexmk'
+            self.directory = self._draft_directory
+            self.make_two_up = self._draft_make_two_up
+            self.includepdfopts = self._draft_includepdfopts
+
+        self.draft = draft
         self.processes = processes
         self.engine = engine
         self.cleanup = cleanup
+        self.timeout = timeout
+        self.retries = retries
+        self.threads = threads
 
-    def _parse_make(self, string, boolean, **kwargs):
+    def _parse_make(self, string, boolean, integer, **kwargs):
         self.name = string('name')
         self.directory = string('directory')
 
         self.two_up = string('two_up', optional=True)
         self.make_two_up = boolean('make_two_up')
 
+        self.linearize = boolean('linearize')
+        self.splice = boolean('splice')
+
+        self.optimize = boolean('optimize')
+        self.optimize_dpi = integer('optimize_dpi')
+
         self._front_name = string('frontmatter')
         self._main_name = string('mainmatter')
         self._extras_name = string('extras')
 
-    def _parse_parts(self, lst, boolean, **kwargs):
-        front = lst('frontmatter', optional=True)
-        main = lst('mainmatter')
-        extras = lst('extras', optional=True)
-
-        dirs = front + main + extras
-
-        dvips = set(lst('use_dvips', optional=True))
-
-        unknown = sorted(dvips.difference(dirs))
+    def _parse_parts(self, string, lst, boolean, **kwargs):
+        lists = {key: lst(key, optional=True)
+                 for key in (*partlist.GROUPS, 'use_dvips')}
+        filename = self._get_path(string('file', optional=True))
+        if filename is not None:
+            for key, parts in partlist.load(filename).items():
+                lists[key] += parts
+        if not lists['mainmatter']:
+            raise ValueError('empty mainmatter option in parts section')
+
+        self.parts = partlist.PartTable.from_groups(
+            [(lists['frontmatter'], self._front_name),
+             (lists['mainmatter'], self._main_name),
+             (lists['extras'], self._extras_name)],
+            name=self.name, dvips=lists['use_dvips'])
+
+        unknown = sorted(set(lists['use_dvips']).difference(p.name for p in self.parts))
         if unknown:
             raise ValueError(unknown)
 
-        files = [os.path.join(self.config_dir, d, d + '.tex') for d in dirs]
-        notfound = [f for f in files if not os.path.isfile(f)]
+        files = [os.path.join(self.config_dir, p.name, f'{p.name}.tex') for p in self.parts]
+        notfound = partlist.missing_files(files)
         if notfound:
             raise ValueError(notfound)
 
-        self._groups = [(front, self._front_name),
-                        (main, self._main_name),
-                        (extras, self._extras_name)]
-        self._dvips = dvips
         self._first_to_front = boolean('first_to_front')
 
     def _parse_template(self, string, **kwargs):
@@ -164,9 +247,25 @@ class Job(object):
     def _parse_substitute(self, items, **kwargs):
         self.context = {k: v.strip() for k, v in items()}
 
-    def _parse_compile(self, string, **kwargs):
+    def _parse_compile(self, string, boolean, integer, **kwargs):
         self.compile_opts = {k: shlex.split(string(k, optional=True, default=''))
                              for k in ('latexmk', 'texify', 'dvips', 'ps2pdf')}
+        self.bibcache = boolean('bibcache')
+        self.warmup = boolean('warmup')
+        self.isolate_cache = boolean('isolate_cache')
+        self.texmf_var = None
+        self.reproducible = boolean('reproducible')
+        self.source_date_epoch = integer('source_date_epoch')
+
+    def _parse_draft(self, string, boolean, integer, **kwargs):
+        self._draft_directory = string('directory')
+        self._draft_make_two_up = boolean('make_two_up')
+        self._draft_max_repeat = integer('max_repeat', optional=True)
+        self._draft_pretex = string('pretex', optional=True)
+        self._draft_includepdfopts: dict[bool, str] = {
+            False: string('include', optional=True, default=self.includepdfopts[False]),
+            True: string('include_two_up', optional=True, default=self.includepdfopts[True]),
+        }
 
     def _parse_paginate(self, string, quoted_string, **kwargs):
         self.paginate_update = string('update')
@@ -187,58 +286,97 @@ class Job(object):
         self.clean_except = lst('except', optional=True)
         self.clean_output = boolean('output')
 
-    def _iter_parts(self, *, groups=None):
-        if groups is None:
-            groups = self._groups
-        for parts, tmpl in groups:
-            for i, part in enumerate(parts):
-                name = tmpl % {'name': self.name,
-                               'part': part,
-                               'index0': i,
-                               'index1': i + 1}
-                yield part, name
+    def environ(self) -> dict[str, str]:
+        """Return the environment variables to set for running TeX."""
+        if not self.reproducible:
+            return {}
+        return {'SOURCE_DATE_EPOCH': os.environ.get('SOURCE_DATE_EPOCH',
+                                                    f'{self.source_date_epoch:d}')}
+
+    def jobname(self, part) -> str:
+        """Return the name of the compilation results of part (without extension)."""
+        return f'{part}{DRAFT_SUFFIX}' if self.draft else part
+
+    def part_options(self, part):
+        """Return the compile options for part (adding the draft ones in draft mode)."""
+        if not self.draft:
+            return self.compile_opts
+        latexmk = [*self.compile_opts['latexmk'], f'-jobname={self.jobname(part)}']
+        if self._draft_pretex:
+            latexmk.append(f'-usepretex={self._draft_pretex}')
+        if self._draft_max_repeat is not None:
+            latexmk += ['-e', f'$max_repeat = {self._draft_max_repeat:d}']
+        return dict(self.compile_opts, latexmk=latexmk)
+
+    def compile_task(self, part: partlist.Part) -> CompileTask:
+        return CompileTask(self.config_dir, part.name, self.jobname(part.name), part.dvips,
+                           self.engine, self.part_options(part.name),
+                           self.timeout, self.retries, self.environ(),
+                           self.isolate_cache, self.texmf_var,
+                           self.optimize_dpi if self.optimize else None,
+                           self.draft and self._draft_max_repeat is not None)
 
     def to_compile(self):
-        for part, _ in self._iter_parts():
-            filename = f'{part}.tex'
-            dvips = part in self._dvips
-            yield self, part, filename, dvips
-
-    def to_compile_only(self, onlypart):
-        to_compile = {args[1]: args for args in self.to_compile()}
-        try:
-            return to_compile[onlypart]
-        except KeyError:
-            raise KeyError(f'Unknown part {onlypart!r}')
+        for part in self.parts:
+            yield self.compile_task(part)
+
+    def to_compile_only(self, onlyparts):
+        if isinstance(onlyparts, str):
+            onlyparts = [onlyparts]
+        result: dict[str, partlist.Part] = {}
+        for pattern in onlyparts:
+            if pattern in self.parts:
+                matched = [self.parts[pattern]]
+            else:
+                matched = [p for p in self.parts if fnmatch.fnmatchcase(p.name, pattern)]
+            if not matched:
+                raise KeyError(f'Unknown part {pattern!r}')
+            for part in matched:
+                result.setdefault(part.name, part)
+        return [self.compile_task(part) for part in result.values()]
 
     def to_update(self):
-        mainmatter = self._groups[1][0]
+        mainmatter = self.parts.group(partlist.MAINMATTER)
         parts = mainmatter[1:] if self._first_to_front else mainmatter
         for part in parts:
-            source = os.path.join(part, f'{part}.tex')
-            pdf = os.path.join(part, f'{part}.pdf')
+            source = os.path.join(part.name, f'{part.name}.tex')
+            pdf = os.path.join(part.name, f'{self.jobname(part.name)}.pdf')
             yield source, pdf
 
+    def target(self, part: partlist.Part) -> str:
+        """Return the path of the copied part PDF (relative to config_dir)."""
+        return os.path.join(self.directory, tools.swapext(part.output, 'pdf'))
+
     def to_copy(self):
-        for part, name in self._iter_parts():
-            source = os.path.join(part, f'{part}.pdf')
-            target = os.path.join(self.directory, tools.swapext(name, 'pdf'))
-            yield source, target
+        for part in self.parts:
+            source = os.path.join(part.name, f'{self.jobname(part.name)}.pdf')
+            yield source, self.target(part)
 
     def to_combine(self):
-        outname = self.name
-        prelims = [name for _, name in self._iter_parts(groups=self._groups[:1])]
-        filenames = [name for _, name in self._iter_parts(groups=self._groups[1:-1])]
+        prelims = self.parts.group(partlist.FRONTMATTER)
+        mainmatter = self.parts.group(partlist.MAINMATTER)
         if self._first_to_front:
-            prelims.append(filenames.pop(0))
-        yield self, outname, self.template, prelims, filenames, False
+            prelims, mainmatter = prelims + mainmatter[:1], mainmatter[1:]
+        yield Combination(self.name, self.template, prelims, mainmatter, False)
 
         if self.make_two_up:
-            outname = self.two_up
-            prelims = []
-            filenames = [name for _, name in self._iter_parts(groups=self._groups[:-1])]
-            yield self, outname, self.template_two_up, prelims, filenames, True
+            mainmatter = self.parts.group(partlist.FRONTMATTER, partlist.MAINMATTER)
+            yield Combination(self.two_up, self.template_two_up, (), mainmatter, True)
+
+    def to_describe(self):
+        for part in self.parts:
+            source = os.path.join(part.name, f'{part.name}.tex')
+            pdf = os.path.join(part.name, f'{self.jobname(part.name)}.pdf')
+            yield self.config_dir, part.name, source, pdf, self.target(part)
+
+    @property
+    def manifest(self) -> str:
+        return os.path.join(self.directory, manifest.FILENAME)
+
+    def to_sources(self):
+        for part in self.parts:
+            yield os.path.join(self.config_dir, part.name, f'{part.name}.tex')
 
     def to_clean(self):
-        for part, _ in self._iter_parts():
-            yield part
+        for part in self.parts:
+            yield part.name
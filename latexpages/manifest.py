@@ -0,0 +1,192 @@
+"""Record page counts, hashes, and sizes of the built parts in the output directory."""
+
+from collections.abc import Iterable
+import functools
+import hashlib
+import json
+import os
+import subprocess
+import typing
+
+from . import backend
+
+__all__ = ['Manifest', 'describe_part', 'describe_combined']
+
+FILENAME = 'latexpages.json'
+
+VERSION = 1
+
+
+def sha256(filename: os.PathLike[str] | str, *, bufsize: int = 2 ** 20) -> str:
+    h = hashlib.sha256()
+    with open(filename, 'rb') as fd:
+        for data in iter(lambda: fd.read(bufsize), b''):
+            h.update(data)
+    return h.hexdigest()
+
+
+def sha256_text(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def stat_key(path: os.PathLike[str] | str) -> list[int] | None:
+    """Return modification time and size of path (None if it does not exist)."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def count_pages(filename: str) -> int | None:
+    """Return the number of pages with pdfinfo/pdftk (None if not available or failed)."""
+    try:
+        npages = backend.Npages.get_func()
+        return npages(filename)
+    except (RuntimeError, subprocess.CalledProcessError, OSError):
+        return None
+
+
+def describe_part(args) -> dict:
+    """Return the manifest entry of a compiled part (paths relative to config_dir)."""
+    (config_dir, part, source, pdf, output) = args
+    path = functools.partial(os.path.join, config_dir)
+    entry = {'part': part,
+             'source': source,
+             'source_sha256': sha256(path(source)),
+             'source_stat': stat_key(path(source)),
+             'pdf': pdf,
+             'pdf_sha256': None,
+             'pdf_stat': stat_key(path(pdf)),
+             'pages': None,
+             'size': None,
+             'output': output,
+             'dir_stat': stat_key(path(part)),
+             'files': sorted(f for f in os.listdir(path(part))
+                             if os.path.isfile(path(part, f)))}
+    if entry['pdf_stat'] is not None:
+        entry['pdf_sha256'] = sha256(path(pdf))
+        entry['pages'] = count_pages(path(pdf))
+        entry['size'] = entry['pdf_stat'][1]
+    return entry
+
+
+def describe_combined(config_dir: str, directory: str, name: str, *,
+                      source_sha256: str | None = None,
+                      combine_key: str | None = None,
+                      page_map: list[list] | None = None) -> dict:
+    """Return the manifest entry of a combined output PDF.
+
+    combine_key is the hash of all its inputs, page_map lists
+    [part, first page, page count] of the included parts.
+    """
+    pdf = os.path.join(directory, f'{name}.pdf')
+    stat = stat_key(os.path.join(config_dir, pdf))
+    entry: dict[str, typing.Any]
+    entry = {'name': name,
+             'pdf': pdf,
+             'sha256': None,
+             'stat': stat,
+             'pages': None,
+             'source_sha256': source_sha256,
+             'combine_key': combine_key,
+             'page_map': page_map}
+    if stat is not None:
+        entry['sha256'] = sha256(os.path.join(config_dir, pdf))
+        if page_map is not None:
+            entry['pages'] = count_pages(os.path.join(config_dir, pdf))
+    return entry
+
+
+class Manifest(object):
+    """Parts, combined outputs, and output directory listing of the last make."""
+
+    @classmethod
+    def load(cls, filename: os.PathLike[str] | str, *, root: str = '') -> 'Manifest':
+        """Return the manifest from filename (empty if missing or unreadable).
+
+        The recorded paths are relative to root (the config_dir of the job).
+        """
+        try:
+            with open(filename, encoding='utf-8') as fd:
+                data = json.load(fd)
+        except (OSError, ValueError):
+            return cls(root=root)
+        if data.get('version') != VERSION:
+            return cls(root=root)
+        return cls(data['parts'], data['combined'],
+                   directory=data['directory'],
+                   directory_stat=data['directory_stat'],
+                   directory_files=data['directory_files'],
+                   root=root)
+
+    def __init__(self, parts: Iterable[dict] = (), combined: Iterable[dict] = (), *,
+                 directory: str | None = None,
+                 directory_stat: list[int] | None = None,
+                 directory_files: list[str] | None = None,
+                 root: str = '') -> None:
+        self.root = root
+        self.parts = {p['part']: p for p in parts}
+        self._by_pdf = {os.path.join(root, p['pdf']): p for p in self.parts.values()}
+        self.combined = {c['name']: c for c in combined}
+        self.directory = directory
+        self.directory_stat = directory_stat
+        self.directory_files = directory_files
+
+    def save(self, filename: os.PathLike[str] | str) -> None:
+        """Write the manifest to filename inside the (existing) output directory.
+
+        Records the output directory listing, so the file is created before
+        taking the directory modification time and then written in place.
+        """
+        if not os.path.exists(filename):
+            open(filename, 'w').close()
+
+        directory = os.path.dirname(filename)
+        self.directory_stat = stat_key(directory)
+        listing = os.listdir(directory)
+        if (self.directory is None
+                or not all(os.path.isfile(os.path.join(directory, f)) for f in listing)):
+            self.directory_files = None
+        else:
+            self.directory_files = sorted(os.path.join(self.directory, f) for f in listing)
+
+        data = {'version': VERSION,
+                'parts': list(self.parts.values()),
+                'combined': list(self.combined.values()),
+                'directory': self.directory,
+                'directory_stat': self.directory_stat,
+                'directory_files': self.directory_files}
+        with open(filename, 'w', encoding='utf-8') as fd:
+            json.dump(data, fd, indent=2)
+
+    def pages(self, pdf: str) -> int | None:
+        """Return the recorded page count of pdf (under root) if it is unchanged, else None."""
+        entry = self._by_pdf.get(pdf)
+        if entry is None or entry['pdf_stat'] != stat_key(pdf):
+            return None
+        return entry['pages']
+
+    def npages_func(self):
+        """Return page counting function using the manifest, pdfinfo/pdftk otherwise."""
+        def npages(pdf: str) -> int:
+            result = self.pages(pdf)
+            if result is None:
+                result = backend.Npages.get_func()(pdf)
+            return result
+
+        return npages
+
+    def part_files(self, part: os.PathLike[str] | str) -> list[str] | None:
+        """Return the recorded files in the part directory if it is unchanged."""
+        entry = self.parts.get(os.fspath(part))
+        if entry is None or entry['dir_stat'] != stat_key(os.path.join(self.root, part)):
+            return None
+        return entry['files']
+
+    def output_files(self, directory: str) -> list[str] | None:
+        """Return the recorded files in the output directory if it is unchanged."""
+        if (directory != self.directory or self.directory_files is None
+                or self.directory_stat != stat_key(os.path.join(self.root, directory))):
+            return None
+        return self.directory_files
@@ -1,11 +1,13 @@
 """Update start pages, update table of contents (8-bit safe)."""
 
+import functools
 import os
 import re
 import string
 
 from . import backend
 from . import jobs
+from . import manifest
 from . import tools
 
 __all__ = ['paginate']
@@ -14,34 +16,39 @@ __all__ = ['paginate']
 def paginate(config) -> bool:
     """Compute and update start page numbers as instructed in config file."""
     job = jobs.Job(config)
-    with tools.chdir(job.config_dir):
-        parts = list(job.to_update())
-        (updated, pages) = startpages(job.paginate_update, parts)
+    path = functools.partial(os.path.join, job.config_dir)
+    parts = [(path(source), path(pdf)) for source, pdf in job.to_update()]
+    built = manifest.Manifest.load(path(job.manifest), root=job.config_dir)
+    (updated, pages) = startpages(job.paginate_update, parts, npages=built.npages_func())
+    target = path(job.paginate_target) if job.paginate_target else ''
+    with tools.lock(os.path.dirname(target) or job.config_dir):
         if job.paginate_template:
             contexts = list(template_contexts(parts, pages,
                                               job.paginate_author_extract,
                                               job.paginate_title_extract))
-            changed = write_contents_template(job.paginate_target, job.paginate_replace,
+            changed = write_contents_template(target,
+                                              job.paginate_replace,
                                               job.paginate_template, contexts)
         else:
-            changed = write_contents(job.paginate_target, job.paginate_replace,
-                                     pages)
+            changed = write_contents(target, job.paginate_replace, pages)
     return updated or changed
 
 
-def startpages(pattern_: str, /, parts):
-    npages = backend.Npages.get_func()
+def startpages(pattern_: str, /, parts, *, npages=None):
+    if npages is None:
+        npages = backend.Npages.get_func()
     pattern = re.compile(pattern_.encode('ascii'))
     modified = False
     result = []
     thepage = 1
     for source, pdf in parts:
         repl = f'{thepage:d}'.encode('ascii')
-        differed = replace(source, pattern, repl)
-        if differed:
-            modified = True
-        result.append(thepage)
-        thepage += npages(pdf)
+        with tools.lock(os.path.dirname(source)):
+            differed = replace(source, pattern, repl)
+            if differed:
+                modified = True
+            result.append(thepage)
+            thepage += npages(pdf)
     return modified, result
 
 
@@ -0,0 +1,125 @@
+"""Immutable table of the collection parts, part lists from CSV/JSON files."""
+
+from collections.abc import Iterable, Iterator, Sequence
+import collections
+import concurrent.futures
+import csv
+import json
+import os
+import typing
+
+__all__ = ['Part', 'PartTable', 'load', 'missing_files']
+
+GROUPS = ('frontmatter', 'mainmatter', 'extras')
+
+FRONTMATTER, MAINMATTER, EXTRAS = range(len(GROUPS))
+
+TRUE = frozenset({'1', 'yes', 'true', 'on'})
+
+PARALLEL_STAT = 64
+
+
+class Part(typing.NamedTuple):
+    """Part directory name, name of its copied PDF, group, and position in group."""
+
+    name: str
+
+    output: str
+
+    group: int
+
+    position: int
+
+    dvips: bool
+
+
+class PartTable(object):
+    """Immutable sequence of parts with lookup by name (built once per job)."""
+
+    __slots__ = ('_parts', '_indexes', '_groups')
+
+    @classmethod
+    def from_groups(cls, groups: Sequence[tuple[Sequence[str], str]], *,
+                    name: str, dvips: Iterable[str] = ()) -> 'PartTable':
+        """Return the table from (part names, output name template) per group."""
+        dvips = frozenset(dvips)
+        return cls(Part(part, tmpl % {'name': name,
+                                      'part': part,
+                                      'index0': i,
+                                      'index1': i + 1},
+                        group, i, part in dvips)
+                   for group, (parts, tmpl) in enumerate(groups)
+                   for i, part in enumerate(parts))
+
+    def __init__(self, parts: Iterable[Part]) -> None:
+        self._parts = tuple(parts)
+        self._indexes = {p.name: i for i, p in enumerate(self._parts)}
+        if len(self._indexes) != len(self._parts):
+            counts = collections.Counter(p.name for p in self._parts)
+            raise ValueError(f'duplicate parts: {sorted(n for n, c in counts.items() if c > 1)!r}')
+        self._groups = tuple(tuple(p for p in self._parts if p.group == group)
+                             for group in range(len(GROUPS)))
+
+    def __repr__(self) -> str:
+        return f'<{self.__class__.__name__} {len(self._parts)} parts>'
+
+    def __len__(self) -> int:
+        return len(self._parts)
+
+    def __iter__(self) -> Iterator[Part]:
+        return iter(self._parts)
+
+    def __contains__(self, name) -> bool:
+        return name in self._indexes
+
+    def __getitem__(self, key: int | str) -> Part:
+        """Return the part with the given index or name."""
+        if isinstance(key, str):
+            key = self._indexes[key]
+        return self._parts[key]
+
+    def index(self, name: str) -> int:
+        return self._indexes[name]
+
+    def group(self, *groups: int) -> tuple[Part, ...]:
+        """Return the parts of the given groups (in group order)."""
+        return tuple(p for group in groups for p in self._groups[group])
+
+
+def load(filename: str, *, encoding: str = 'utf-8') -> dict[str, list[str]]:
+    """Return part names per group and use_dvips from a .json or .csv file.
+
+    JSON: object with the keys of the parts section (lists of part names).
+    CSV: rows with part, group (default: mainmatter), and dvips columns.
+    """
+    result: dict[str, list[str]] = {key: [] for key in (*GROUPS, 'use_dvips')}
+    if filename.lower().endswith('.json'):
+        with open(filename, encoding=encoding) as fd:
+            data = json.load(fd)
+        unknown = sorted(set(data).difference(result))
+        if unknown:
+            raise ValueError(f'unknown keys in {filename!r}: {unknown!r}')
+        for key, parts in data.items():
+            result[key].extend(parts)
+        return result
+
+    with open(filename, encoding=encoding, newline='') as fd:
+        for row in csv.DictReader(fd):
+            part = row['part'].strip()
+            group = (row.get('group') or 'mainmatter').strip()
+            if group not in GROUPS:
+                raise ValueError(f'unknown group in {filename!r}: {group!r}')
+            result[group].append(part)
+            if (row.get('dvips') or '').strip().lower() in TRUE:
+                result['use_dvips'].append(part)
+    return result
+
+
+def missing_files(filenames: Sequence[str]) -> list[str]:
+    """Return the filenames that are not existing files (checked concurrently)."""
+    if len(filenames) < PARALLEL_STAT:
+        exists = list(map(os.path.isfile, filenames))
+    else:
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            exists = list(executor.map(os.path.isfile, filenames))
+    return [f for f, e in zip(filenames, exists, strict=True) if not e]
@@ -110,16 +110,20 @@ class Source(Document, Template):
         return self.substitute(context)
 
     def render(self, filename, *, two_up=False, view=False, engine=None,
-               options=None, cleanup: bool = False) -> None:
+               options=None, timeout=None, env=None, output=None,
+               cleanup: bool = False) -> int:
+        """Write the source to filename and compile it, return the exit status."""
         source = self.source(two_up=two_up)
 
         with open(filename, 'w', encoding=self._encoding) as fd:
             fd.write(source)
 
-        backend.compile(filename, view=view, engine=engine, options=options)
+        returncode = backend.compile(filename, view=view, engine=engine, options=options,
+                                     timeout=timeout, output=output, env=env)
 
         if cleanup:
             self.cleanup(filename)
+        return returncode
 
     def cleanup(self, filename) -> None:
         namefiles = glob.glob(tools.swapext(filename, '*'))
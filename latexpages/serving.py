@@ -0,0 +1,246 @@
+"""Serve make, paginate, and clean over a local HTTP API with a shared pool."""
+
+from collections.abc import Callable
+import collections
+import contextlib
+import http.server
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import traceback
+
+from . import building
+from . import cleaning
+from . import numbering
+from . import tools
+
+__all__ = ['serve', 'Server']
+
+ACTIONS: dict[str, tuple[Callable[..., object], tuple[str, ...]]] = {
+    'make': (building.make, ('engine', 'cleanup', 'only', 'combine',
+                             'timeout', 'retries', 'draft')),
+    'paginate': (numbering.paginate, ()),
+    'clean': (cleaning.clean, ('clean_output',))}
+
+DONE = None
+
+
+class ThreadStdout(object):
+    """sys.stdout replacement sending the output of redirected threads to a sink."""
+
+    def __init__(self, stream) -> None:
+        self._stream = stream
+        self._local = threading.local()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def write(self, s: str) -> int:
+        sink = getattr(self._local, 'sink', None)
+        if sink is None:
+            return self._stream.write(s)
+        sink(s)
+        return len(s)
+
+    def flush(self) -> None:
+        if getattr(self._local, 'sink', None) is None:
+            self._stream.flush()
+
+    @contextlib.contextmanager
+    def redirect(self, sink: Callable[[str], None]):
+        """Send everything the current thread prints to sink inside the context."""
+        self._local.sink = sink
+        try:
+            yield self
+        finally:
+            self._local.sink = None
+
+
+class Task(object):
+    """Queued action on a collection, broadcasting its output to subscribers."""
+
+    def __init__(self, action: str, config: str, kwargs) -> None:
+        self.action = action
+        self.config = config
+        self.kwargs = kwargs
+        self.key = (action, config, json.dumps(kwargs, sort_keys=True))
+        self._lock = threading.Lock()
+        self._backlog: list[str] = []
+        self._subscribers: list[queue.SimpleQueue] = []
+        self._done = False
+
+    def __repr__(self) -> str:
+        return f'<{self.__class__.__name__} {self.action} {self.config!r}>'
+
+    def subscribe(self):
+        """Return an iterator over all output of the task until it is done."""
+        chunks: queue.SimpleQueue = queue.SimpleQueue()
+        with self._lock:
+            for chunk in self._backlog:
+                chunks.put(chunk)
+            if self._done:
+                chunks.put(DONE)
+            self._subscribers.append(chunks)
+        while (chunk := chunks.get()) is not DONE:
+            yield chunk
+
+    def publish(self, chunk: str | None) -> None:
+        with self._lock:
+            if chunk is DONE:
+                self._done = True
+            else:
+                self._backlog.append(chunk)
+            for chunks in self._subscribers:
+                chunks.put(chunk)
+
+    def run(self, pool, stdout: ThreadStdout) -> None:
+        func, _ = ACTIONS[self.action]
+        kwargs = dict(self.kwargs)
+        if self.action == 'make':
+            kwargs['pool'] = pool
+        elif self.action == 'clean':
+            kwargs['confirm'] = False
+        try:
+            with stdout.redirect(self.publish):
+                print(f'latexpages-serve: {self.action} {self.config}')
+                try:
+                    result = func(self.config, **kwargs)
+                except Exception:
+                    traceback.print_exc(file=sys.stdout)
+                    print(f'latexpages-serve: {self.action} failed')
+                else:
+                    if self.action == 'make' and not result:
+                        print(f'latexpages-serve: {self.action} failed')
+                    else:
+                        print(f'latexpages-serve: {self.action} done')
+        finally:
+            self.publish(DONE)
+
+
+class Collection(object):
+    """Serial queue of tasks for one INI file, coalescing duplicate requests."""
+
+    def __init__(self, config: str, server: 'Server') -> None:
+        self.config = config
+        self._server = server
+        self._pending: collections.OrderedDict = collections.OrderedDict()
+        self._ready = threading.Condition()
+        self._thread = threading.Thread(target=self._work, daemon=True,
+                                        name=f'latexpages-serve {config}')
+        self._thread.start()
+
+    def submit(self, action: str, kwargs) -> Task:
+        """Queue a task, or return the equal one already waiting in the queue."""
+        task = Task(action, self.config, kwargs)
+        with self._ready:
+            task = self._pending.setdefault(task.key, task)
+            self._ready.notify()
+        return task
+
+    def pending(self) -> int:
+        with self._ready:
+            return len(self._pending)
+
+    def _work(self) -> None:
+        while True:
+            with self._ready:
+                self._ready.wait_for(lambda: self._pending)
+                (_, task) = self._pending.popitem(last=False)
+            task.run(self._server.pool, self._server.stdout)
+
+
+class Server(http.server.ThreadingHTTPServer):
+    """HTTP server running latexpages actions on one shared worker pool."""
+
+    daemon_threads = True
+
+    def __init__(self, address, *, processes=None, threads: bool = False) -> None:
+        pool_cls = tools.ThreadPool if threads else multiprocessing.Pool
+        self.pool = pool_cls(processes, tools.init_worker)
+        self.stdout = ThreadStdout(sys.stdout)
+        self.collections: dict[str, Collection] = {}
+        self._lock = threading.Lock()
+        super().__init__(address, RequestHandler)
+
+    def submit(self, action: str, config: str, kwargs) -> Task:
+        config = os.path.realpath(config)
+        if not os.path.exists(config):
+            raise ValueError(f'file not found: {config!r}')
+        with self._lock:
+            if config not in self.collections:
+                self.collections[config] = Collection(config, self)
+            collection = self.collections[config]
+        return collection.submit(action, kwargs)
+
+    def status(self):
+        with self._lock:
+            return {config: c.pending() for config, c in self.collections.items()}
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.pool.terminate()
+        self.pool.join()
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    """``POST /<action>`` with JSON ``{"config": <INI file>, ...}``, ``GET /``."""
+
+    server: Server
+
+    def do_GET(self) -> None:  # noqa: N802
+        if self.path != '/':
+            self.send_error(404)
+            return
+        body = json.dumps({'actions': sorted(ACTIONS),
+                           'pending': self.server.status()}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self) -> None:  # noqa: N802
+        action = self.path.strip('/')
+        if action not in ACTIONS:
+            self.send_error(404, f'unknown action: {action!r}')
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            params = json.loads(self.rfile.read(length) or b'{}')
+            config = params.pop('config')
+            (_, allowed) = ACTIONS[action]
+            unknown = sorted(set(params).difference(allowed))
+            if unknown:
+                raise ValueError(f'unknown options: {unknown!r}')
+            task = self.server.submit(action, config, params)
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_error(400, str(e))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.end_headers()
+        try:
+            for chunk in task.subscribe():
+                self.wfile.write(chunk.encode('utf-8'))
+                self.wfile.flush()
+        except ConnectionError:
+            pass
+
+
+def serve(*, host: str = '127.0.0.1', port: int = 8000, processes=None,
+          threads: bool = False) -> None:
+    """Serve make, paginate, and clean requests until interrupted."""
+    with Server((host, port), processes=processes, threads=threads) as server:
+        sys.stdout = server.stdout
+        print(f'latexpages-serve: listening on http://{host}:{server.server_port}/')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sys.stdout = server.stdout._stream
@@ -0,0 +1,173 @@
+"""Parse latexmk output and TeX log into per-part compile statistics."""
+
+from collections.abc import Iterable, Iterator, Sequence
+import os
+import re
+
+__all__ = ['Stats', 'format_table']
+
+ENGINES = frozenset({'latex', 'pdflatex', 'lualatex', 'xelatex'})
+
+TOOLS = frozenset({'bibtex', 'biber', 'makeindex', 'makeglossaries', 'xindy'})
+
+RUN = re.compile(r"Run number (\d+) of rule '\*?([^'*]+)\*?'")
+
+RULE = re.compile(r"^Rule '\*?([^'*]+)\*?':\s*(.*)$")
+
+OVERFULL = re.compile(rb'^Overfull \\[hv]box', re.MULTILINE)
+
+UNDERFULL = re.compile(rb'^Underfull \\[hv]box', re.MULTILINE)
+
+WARNING = re.compile(rb'^(?:LaTeX|Package \S+|Class \S+) Warning', re.MULTILINE)
+
+WARNING_TEXT = re.compile(rb'^(?:LaTeX|Package \S+|Class \S+) Warning: (.*)'
+                          rb'((?:\n\(\S+\) +.*)*)', re.MULTILINE)
+
+CONTINUATION = re.compile(rb'\n\(\S+\) +')
+
+RERUN = re.compile(rb'rerun|re-run|run again', re.IGNORECASE)
+
+
+class Stats(object):
+    """Compile statistics of a part."""
+
+    def __init__(self, part: str, status: str, duration: float, *,
+                 passes: int = 0,
+                 reruns: Sequence[str] = (),
+                 tools: Sequence[tuple[str, float]] = (),
+                 overfull: int = 0, underfull: int = 0, warnings: int = 0,
+                 output: Sequence[str] = (),
+                 sizes: tuple[int, int] | None = None) -> None:
+        self.part = part
+        self.status = status
+        self.duration = duration
+        self.passes = passes
+        self.reruns = list(reruns)
+        self.tools = list(tools)
+        self.overfull = overfull
+        self.underfull = underfull
+        self.warnings = warnings
+        self.output = list(output)
+        self.sizes = sizes
+
+    def __repr__(self) -> str:
+        return (f'<{self.__class__.__name__} {self.part!r}'
+                f' {self.status} {self.duration:.1f}s'
+                f' passes={self.passes}>')
+
+    @classmethod
+    def from_compile(cls, part: str, status: str, duration: float,
+                     output: Sequence[tuple[float, str]], logfile: str, *,
+                     end: float, sizes: tuple[int, int] | None = None) -> 'Stats':
+        """Return the stats from timestamped console output and TeX log."""
+        # latexmk -silent hardly ever tells why it reran (no Rule diagnostics),
+        # a rerun request left in the final log is the likely cause of the reruns
+        pending = rerun_warnings(logfile)
+        passes, reruns, tools = parse_output(output, end=end,
+                                             default='; '.join(pending) or 'unknown')
+        if pending:
+            reruns.append(f'still requested after {passes} passes: {"; ".join(pending)}')
+        overfull, underfull, warnings = parse_log(logfile)
+        return cls(part, status, duration,
+                   passes=passes, reruns=reruns, tools=tools,
+                   overfull=overfull, underfull=underfull, warnings=warnings,
+                   output=[line for _, line in output], sizes=sizes)
+
+    def size_summary(self) -> str:
+        """Return the PDF size before and after optimizing (empty if not optimized)."""
+        if self.sizes is None:
+            return ''
+        (before, after) = self.sizes
+        return (f'{before / 1024:.0f} kB -> {after / 1024:.0f} kB'
+                f' ({(after - before) / before:+.0%})' if before else '')
+
+    def tools_summary(self) -> str:
+        totals: dict[str, list[float]] = {}
+        for name, seconds in self.tools:
+            totals.setdefault(name, []).append(seconds)
+        return ', '.join(f'{name} {len(times)}x {sum(times):.1f}s'
+                         for name, times in totals.items())
+
+
+def iter_runs(output: Sequence[tuple[float, str]], *,
+              end: float) -> Iterator[tuple[str, int, float, str]]:
+    """Yield (rule, number, duration, rerun reason) for each latexmk rule run."""
+    runs = []
+    reason: list[str] | None = None
+    for timestamp, line in output:
+        ma = RUN.search(line)
+        if ma is not None:
+            number, rule = int(ma.group(1)), ma.group(2).strip()
+            runs.append((rule, number, timestamp, ', '.join(reason or [])))
+            reason = None
+        elif RULE.match(line) is not None:
+            reason = []
+        elif reason is not None and line[:1].isspace() and line.strip():
+            reason.append(line.strip().strip("'"))
+
+    for i, (rule, number, start, reason_) in enumerate(runs):
+        stop = runs[i + 1][2] if i + 1 < len(runs) else end
+        yield rule, number, stop - start, reason_
+
+
+def parse_output(output: Sequence[tuple[float, str]], *, end: float,
+                 default: str = 'unknown') -> tuple[int, list[str], list[tuple[str, float]]]:
+    """Return passes, rerun reasons (or default), and (tool, seconds) from latexmk output."""
+    passes = 0
+    reruns = []
+    tools = []
+    for rule, number, duration, reason in iter_runs(output, end=end):
+        (name, *_) = rule.split()
+        if name in ENGINES:
+            passes += 1
+            if number > 1:
+                reruns.append(f'{name} {number}: {reason or default}')
+        elif name in TOOLS:
+            tools.append((name, duration))
+    return passes, reruns, tools
+
+
+def parse_log(filename: os.PathLike[str] | str) -> tuple[int, int, int]:
+    """Return the number of overfull boxes, underfull boxes, and warnings."""
+    try:
+        with open(filename, 'rb') as fd:
+            data = fd.read()
+    except FileNotFoundError:
+        return 0, 0, 0
+    return (len(OVERFULL.findall(data)),
+            len(UNDERFULL.findall(data)),
+            len(WARNING.findall(data)))
+
+
+def rerun_warnings(filename: os.PathLike[str] | str) -> list[str]:
+    """Return the LaTeX/package/class warnings in the log asking for a rerun."""
+    try:
+        with open(filename, 'rb') as fd:
+            data = fd.read()
+    except FileNotFoundError:
+        return []
+    result = []
+    for ma in WARNING_TEXT.finditer(data):
+        text = CONTINUATION.sub(b' ', ma.group(1) + ma.group(2)).strip()
+        if RERUN.search(text) is not None:
+            message = text.decode('utf-8', 'replace').rstrip('.')
+            if message not in result:
+                result.append(message)
+    return result
+
+
+def format_table(stats: Iterable[Stats]) -> str:
+    """Return a summary table of stats, most expensive part first."""
+    stats = sorted(stats, key=lambda s: s.duration, reverse=True)
+    header = ('part', 'status', 'time', 'passes',
+              'overfull', 'underfull', 'warnings', 'tools')
+    rows = [header]
+    rows += [(s.part, s.status, f'{s.duration:.1f}s', str(s.passes),
+              str(s.overfull), str(s.underfull), str(s.warnings),
+              s.tools_summary()) for s in stats]
+    widths = [max(len(r[i]) for r in rows) for i in range(len(header))]
+    lines = ['  '.join(c.ljust(w) for c, w in zip(r, widths, strict=True)).rstrip()
+             for r in rows]
+    for s in stats:
+        lines += [f'{s.part}: rerun {r}' for r in s.reruns]
+    return '\n'.join(lines)
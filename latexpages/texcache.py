@@ -0,0 +1,116 @@
+"""Warm up TeX font caches, give each part compilation its own TEXMFVAR."""
+
+from collections.abc import Iterator
+import contextlib
+import hashlib
+import itertools
+import os
+import shutil
+import subprocess
+
+from . import backend
+from . import tools
+
+__all__ = ['warmup', 'texmfvar', 'update_generation', 'overlay']
+
+WARMUP_CMDS = [['luaotfload-tool', '--update'],
+               ['fc-cache']]
+
+OVERLAYS = 'texmf-var'
+
+GENERATION = 'generation'
+
+
+def warmup(*, timeout=None) -> None:
+    """Update the luaotfload and fontconfig caches once (where available)."""
+    for cmd in WARMUP_CMDS:
+        path = backend.which(cmd[0])
+        if path is None:
+            continue
+        print(f'latexpages: warming up {cmd[0]}')
+        output: list[tuple[float, str]] = []
+        try:
+            backend.run([path, *cmd[1:]], timeout=timeout, output=output)
+        except subprocess.TimeoutExpired:
+            print(f'latexpages: {cmd[0]} timed out after {timeout} seconds')
+        finally:
+            for _, line in output:
+                print(f'{cmd[0]}: {line}')
+
+
+def texmfvar() -> str | None:
+    """Return the TEXMFVAR directory from kpsewhich (None if not available)."""
+    kpsewhich = backend.which('kpsewhich')
+    if kpsewhich is None:
+        return None
+    result = subprocess.run([kpsewhich, '-var-value', 'TEXMFVAR'],
+                            stdin=subprocess.DEVNULL, capture_output=True,
+                            encoding='utf-8', startupinfo=backend.get_startupinfo())
+    return result.stdout.strip() or None
+
+
+def update_generation(seed: str) -> bool:
+    """Mark all overlays for reseeding if seed changed (e.g. by warmup), return if it did.
+
+    The generation is a hash of the file listing of seed with modification
+    times and sizes, so an unchanged seed is not copied into the overlays again.
+    """
+    root = tools.cache_dir(OVERLAYS)
+    os.makedirs(root, exist_ok=True)
+    generation = snapshot(seed)
+    if _read(os.path.join(root, GENERATION)) == generation:
+        return False
+    with open(os.path.join(root, GENERATION), 'w', encoding='ascii') as fd:
+        fd.write(generation)
+    return True
+
+
+def snapshot(path: str) -> str:
+    """Return the hash of the files below path with their modification times and sizes."""
+    h = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for name in sorted(filenames):
+            filename = os.path.join(dirpath, name)
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            h.update(f'{os.path.relpath(filename, path)}\0{st.st_mtime_ns}'
+                     f'\0{st.st_size}\0'.encode('utf-8', 'surrogateescape'))
+    return h.hexdigest()
+
+
+def _read(filename) -> str | None:
+    try:
+        with open(filename, encoding='ascii') as fd:
+            return fd.read()
+    except OSError:
+        return None
+
+
+@contextlib.contextmanager
+def overlay(seed: str | None, *, env=None) -> Iterator[dict[str, str]]:
+    """Claim a free writable TEXMFVAR copied from seed, yield env (or os.environ) using it.
+
+    Each claimed directory is locked, so parallel workers (and concurrent
+    runs) never share one. It is reseeded when the generation changed.
+    """
+    root = tools.cache_dir(OVERLAYS)
+    for slot in itertools.count():
+        path = os.path.join(root, f'{slot:d}')
+        os.makedirs(path, exist_ok=True)
+        with tools.try_lock(path) as acquired:
+            if not acquired:
+                continue
+
+            generation = _read(os.path.join(root, GENERATION)) or ''
+            marker = os.path.join(path, f'.{GENERATION}')
+            if _read(marker) != generation:
+                if seed is not None and os.path.isdir(seed):
+                    shutil.copytree(seed, path, dirs_exist_ok=True)
+                with open(marker, 'w', encoding='ascii') as fd:
+                    fd.write(generation)
+
+            yield dict(os.environ if env is None else env, TEXMFVAR=path)
+            return
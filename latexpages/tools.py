@@ -1,14 +1,19 @@
 """Generic path and filename manipulations."""
 
 from collections.abc import Iterator
+import concurrent.futures
 import contextlib
 import os
 import signal
 import sys
+import threading
+import time
 
-__all__ = ['swapext', 'current_path', 'chdir',
+__all__ = ['swapext', 'current_path', 'cache_dir',
+           'lock', 'try_lock',
            'confirm',
-           'ignore_sigint', 'NullPool']
+           'ignore_sigint', 'init_worker', 'exit_on_term', 'NullPool',
+           'ThreadPool', 'StoppedError', 'stop_event']
 
 
 def swapext(filename: str, extension: str, *, delimiter: str = '.') -> str:
@@ -43,22 +48,80 @@ def current_path(*names: os.PathLike[str] | str) -> str:
     return os.path.realpath(path)
 
 
+def cache_dir(*names: str) -> str:
+    """Return the path to names in the latexpages user cache directory."""
+    if sys.platform == 'win32':  # pragma: no cover
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'latexpages', *names)
+
+
+LOCKFILE = '.latexpages.lock'
+
+if sys.platform == 'win32':  # pragma: no cover
+    import msvcrt
+
+    def _trylock(fd) -> bool:
+        try:
+            msvcrt.locking(fd.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+        return True
+
+    def _lock(fd) -> None:
+        while not _trylock(fd):
+            time.sleep(0.1)
+
+    def _unlock(fd) -> None:
+        fd.seek(0)
+        msvcrt.locking(fd.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _trylock(fd) -> bool:
+        try:
+            fcntl.flock(fd.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    def _lock(fd) -> None:
+        fcntl.flock(fd.fileno(), fcntl.LOCK_EX)
+
+    def _unlock(fd) -> None:
+        fcntl.flock(fd.fileno(), fcntl.LOCK_UN)
+
+
 @contextlib.contextmanager
-def chdir(*paths: os.PathLike[str] | str | None) -> Iterator[str | None]:
-    """Change the current working directory, restore on context exit."""
+def lock(*paths: os.PathLike[str] | str | None) -> Iterator[bool]:
+    """Hold an exclusive lock on the directory (inter-process), yield if it had to wait."""
     path_parts: list[os.PathLike[str] | str]
     path_parts = [p if p is not None else '' for p in paths]
-    path = os.path.join(*path_parts)
-    if not path:
-        yield None
-        return
+    filename = os.path.join(*path_parts, LOCKFILE)
+    with open(filename, 'a') as fd:
+        waited = not _trylock(fd)
+        if waited:
+            _lock(fd)
+        try:
+            yield waited
+        finally:
+            _unlock(fd)
 
-    oldwd = os.getcwd()
-    os.chdir(path)
-    try:
-        yield os.fspath(path)
-    finally:
-        os.chdir(oldwd)
+
+@contextlib.contextmanager
+def try_lock(*paths: os.PathLike[str] | str | None) -> Iterator[bool]:
+    """Lock the directory if it is not locked already, yield if the lock was acquired."""
+    path_parts: list[os.PathLike[str] | str]
+    path_parts = [p if p is not None else '' for p in paths]
+    filename = os.path.join(*path_parts, LOCKFILE)
+    with open(filename, 'a') as fd:
+        acquired = _trylock(fd)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                _unlock(fd)
 
 
 def confirm(question: str, *, default: bool = False) -> bool:
@@ -80,19 +143,52 @@ def ignore_sigint() -> None:
     signal.signal(signal.SIGINT, signal.SIG_IGN)
 
 
+def exit_on_sigterm(signum, frame) -> None:
+    """Raise SystemExit so running subprocesses can be killed on the way out."""
+    sys.exit(128 + signum)
+
+
+def init_worker() -> None:
+    """Ignore KeyboardInterrupt, exit cleanly on terminate (Pool initializer)."""
+    ignore_sigint()
+    signal.signal(signal.SIGTERM, exit_on_sigterm)
+
+
+@contextlib.contextmanager
+def exit_on_term() -> Iterator[None]:
+    """Raise SystemExit on SIGTERM in the main thread while inside the block.
+
+    The compilations run in their own process groups, so a SIGTERM sent to
+    the process group of latexpages does not reach them.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        yield
+        return
+    previous = signal.signal(signal.SIGTERM, exit_on_sigterm)
+    try:
+        yield
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+
+
 class NullPool(object):
     """No-subprocess replacement for multiprocessing.Pool."""
 
     def __init__(self, processes=None, initializer=None):
         if processes not in (1, None):
             raise ValueError(f'{self} with {processes=}')
-        assert initializer in (ignore_sigint, None)
+        assert initializer in (ignore_sigint, init_worker, None)
 
     def map(self, func, iterable, *, chunksize=None):
         if chunksize not in (1, None):
             raise ValueError(f'{self}.map() with {chunksize=}')
         return list(map(func, iterable))
 
+    def imap_unordered(self, func, iterable, *, chunksize=None):
+        if chunksize not in (1, None):
+            raise ValueError(f'{self}.imap_unordered() with {chunksize=}')
+        return map(func, iterable)
+
     def terminate(self):
         pass
 
@@ -101,3 +197,48 @@ class NullPool(object):
 
     def join(self):
         pass
+
+
+class StoppedError(Exception):
+    """Raised in ThreadPool worker threads running a subprocess after terminate()."""
+
+
+_worker = threading.local()
+
+
+def stop_event() -> threading.Event | None:
+    """Return the stop event of the ThreadPool running the current thread (if any)."""
+    return getattr(_worker, 'stop', None)
+
+
+class ThreadPool(object):
+    """multiprocessing.Pool replacement running in threads (ThreadPoolExecutor)."""
+
+    def __init__(self, processes=None, initializer=None):
+        # signal handlers are process-wide, the main thread handles them
+        assert initializer in (ignore_sigint, init_worker, None)
+        self._stop = threading.Event()
+        self._executor = concurrent.futures.ThreadPoolExecutor(processes or os.cpu_count(),
+                                                               thread_name_prefix='latexpages',
+                                                               initializer=self._init_thread)
+
+    def _init_thread(self):
+        _worker.stop = self._stop
+
+    def map(self, func, iterable, *, chunksize=None):
+        return list(self._executor.map(func, iterable))
+
+    def imap_unordered(self, func, iterable, *, chunksize=None):
+        futures = [self._executor.submit(func, item) for item in iterable]
+        return (f.result() for f in concurrent.futures.as_completed(futures))
+
+    def terminate(self):
+        """Cancel pending tasks, make running ones kill their subprocesses."""
+        self._stop.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def join(self):
+        self._executor.shutdown(wait=True)